@@ -0,0 +1,169 @@
+"""Аутентификация по токену с кешем пользователей.
+
+``TokenAuthentication`` из DRF на каждый запрос выбирает токен вместе с
+пользователем. ``CachedTokenAuthentication`` хранит снимок этих строк
+(значения полей) в памяти процесса: не больше ``AUTH_TOKEN_CACHE_SIZE``
+записей, при переполнении вытесняются давно не использованные. Если задан
+``AUTH_TOKEN_CACHE`` (алиас из ``CACHES``), снимки хранятся и там, и промах
+в памяти процесса не доходит до базы. В обоих хранилищах снимок живёт
+``AUTH_TOKEN_CACHE_TIMEOUT`` секунд.
+
+Снимки удаляются после выхода (удаления токена), сохранения пользователя
+(смена пароля, блокировка) и его удаления — см. ``api.signals``. Удаление
+доходит до общего кеша и памяти текущего процесса; в остальных процессах
+(и если снимок был прочитан из базы одновременно с удалением) он может
+прожить до ``AUTH_TOKEN_CACHE_TIMEOUT`` секунд, поэтому время жизни
+выбрано коротким.
+
+Счётчики поля ``stats``: ``hit`` — из памяти процесса, ``shared`` — из
+общего кеша, ``miss`` — из базы.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+SNAPSHOT_EXCLUDE = frozenset(('password',))
+
+
+def snapshot_fields(model):
+    """Поля модели, попадающие в снимок.
+
+    Счётчики (``editable=False``) меняются запросами UPDATE в обход
+    модели, поэтому в снимок не входят: у восстановленного объекта они
+    отложены, и ``save()`` не перезапишет их устаревшими значениями.
+    Хеш пароля для аутентификации по токену не нужен и не должен лежать в
+    общем кеше; при проверке пароля (смена через djoser) он загружается
+    из базы как отложенное поле.
+    """
+    return [
+        field.attname for field in model._meta.concrete_fields
+        if field.primary_key
+        or field.editable and field.name not in SNAPSHOT_EXCLUDE
+    ]
+
+
+class TokenCache:
+    """Двухуровневый кеш снимков токена и пользователя"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.stats = Counter()
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        alias = settings.AUTH_TOKEN_CACHE
+        return caches[alias] if alias else None
+
+    def cache_key(self, key):
+        # В общий кеш не попадает сам токен.
+        return f'{self.prefix}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    def get(self, key):
+        cache_key = self.cache_key(key)
+        with self._lock:
+            entry = self._local.get(cache_key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._local.move_to_end(cache_key)
+                self.stats['hit'] += 1
+                return entry[1]
+        shared = self.shared
+        snapshot = shared.get(cache_key) if shared is not None else None
+        if snapshot is not None:
+            self.stats['shared'] += 1
+            self._remember(cache_key, snapshot)
+        return snapshot
+
+    def set(self, key, snapshot):
+        cache_key = self.cache_key(key)
+        shared = self.shared
+        if shared is not None:
+            shared.set(cache_key, snapshot, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        self._remember(cache_key, snapshot)
+
+    def _remember(self, cache_key, snapshot):
+        timeout = settings.AUTH_TOKEN_CACHE_TIMEOUT
+        if timeout <= 0:
+            return
+        with self._lock:
+            self._local[cache_key] = (time.monotonic() + timeout, snapshot)
+            self._local.move_to_end(cache_key)
+            while len(self._local) > settings.AUTH_TOKEN_CACHE_SIZE:
+                self._local.popitem(last=False)
+
+    def invalidate(self, keys):
+        cache_keys = [self.cache_key(key) for key in keys]
+        if not cache_keys:
+            return
+        with self._lock:
+            for cache_key in cache_keys:
+                self._local.pop(cache_key, None)
+        shared = self.shared
+        if shared is not None:
+            shared.delete_many(cache_keys)
+
+    def clear(self):
+        """Очищает память процесса (общий кеш не затрагивается)."""
+        with self._lock:
+            self._local.clear()
+
+    def hit_rate(self):
+        total = sum(self.stats[name] for name in ('hit', 'shared', 'miss'))
+        return (self.stats['hit'] + self.stats['shared']) / total if (
+            total) else 0.0
+
+
+token_cache = TokenCache('auth:token')
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication``, читающий токен и пользователя из кеша"""
+
+    def snapshot(self, token):
+        user = token.user
+        return (
+            token.created,
+            tuple(getattr(user, name) for name in snapshot_fields(
+                type(user))),
+        )
+
+    def restore(self, key, snapshot):
+        # Объекты собираются заново на каждый запрос, поэтому изменения
+        # request.user не переходят между запросами.
+        created, values = snapshot
+        user_model = get_user_model()
+        user = user_model.from_db(router.db_for_read(user_model),
+                                  snapshot_fields(user_model), values)
+        model = self.get_model()
+        token = model.from_db(router.db_for_read(model),
+                              ['key', 'user_id', 'created'],
+                              [key, user.pk, created])
+        token.user = user
+        return token
+
+    def authenticate_credentials(self, key):
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            token_cache.stats['miss'] += 1
+            try:
+                token = self.get_model().objects.select_related(
+                    'user').get(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            snapshot = self.snapshot(token)
+            token_cache.set(key, snapshot)
+        token = self.restore(key, snapshot)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return token.user, token
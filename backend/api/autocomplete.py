@@ -0,0 +1,82 @@
+"""Автодополнение названий ингредиентов.
+
+На PostgreSQL поиск идёт по GIN-индексу pg_trgm на ``UPPER(name)`` (его
+создаёт миграция ``recipes.0003_postgresql_search_indexes``). На
+остальных базах используется отсортированный по названию индекс в памяти
+процесса: каталог ингредиентов небольшой и меняется редко, а актуальность
+индекса сверяется с версией справочника из ``api.cache``.
+"""
+from bisect import bisect_left
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+
+from recipes.models import Ingredient
+from .cache import ingredients_catalog
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+
+def rank_by_prefix(queryset, name):
+    """Фильтрует по подстроке, ставя совпадения с начала названия первыми."""
+    return queryset.filter(name__icontains=name).annotate(
+        prefix_rank=Case(
+            When(name__istartswith=name, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by('prefix_rank', 'name')
+
+
+class PrefixIndex:
+    """Отсортированный список названий ингредиентов для поиска по префиксу."""
+
+    def __init__(self, rows, version=None):
+        rows = sorted(rows, key=lambda row: (row['name'].lower(), row['id']))
+        self.keys = [row['name'].lower() for row in rows]
+        self.rows = rows
+        self.version = version
+
+    @classmethod
+    def from_db(cls, version=None):
+        return cls(Ingredient.objects.values(
+            'id', 'name', 'measurement_unit').order_by(), version)
+
+    def search(self, name, limit):
+        name = name.lower()
+        start = bisect_left(self.keys, name)
+        found = []
+        for position in range(start, len(self.keys)):
+            if len(found) >= limit or not self.keys[position].startswith(
+                    name):
+                break
+            found.append(position)
+        if len(found) < limit:
+            prefixed = set(found)
+            for position, key in enumerate(self.keys):
+                if len(found) >= limit:
+                    break
+                if name in key and position not in prefixed:
+                    found.append(position)
+        return [self.rows[position] for position in found]
+
+
+_index = None
+
+
+def get_index():
+    global _index
+    version = ingredients_catalog.version()
+    if _index is None or _index.version != version:
+        _index = PrefixIndex.from_db(version)
+    return _index
+
+
+def autocomplete(name, limit=DEFAULT_LIMIT):
+    """Возвращает не более ``limit`` ингредиентов, совпадения с начала
+    названия идут первыми."""
+    if connection.vendor == 'postgresql':
+        return list(rank_by_prefix(Ingredient.objects.all(), name).values(
+            'id', 'name', 'measurement_unit')[:limit])
+    return get_index().search(name, limit)
@@ -0,0 +1,783 @@
+"""Нагрузочные сценарии для API.
+
+Модуль наполняет базу синтетическими данными и прогоняет запросы ко всем
+эндпоинтам из ``api/urls.py``, измеряя количество SQL-запросов, время
+ответа и размер тела ответа. Используется командой ``benchmark_api``.
+"""
+import random
+import time
+from base64 import b64encode
+from contextlib import contextmanager, nullcontext
+from io import BytesIO, StringIO
+from itertools import cycle, groupby
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+from django.http import HttpResponse, JsonResponse
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from api.cache import recipe_responses
+from api.images import make_thumbnail
+from api.instrumentation import metrics
+from api.matching import get_matcher
+from api.parsers import FastJSONParser
+from api.renderers import FastJSONRenderer
+from recipes.feed import feed_recipe_ids, rebuild_timelines
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingListItem, Tag)
+from recipes.search import index_recipes, search_recipes
+from users.models import Subscription, User
+
+# Белый PNG 1x1 для создания и редактирования рецептов.
+PIXEL = ('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/'
+         'AAX+Av4N70a4AAAAAElFTkSuQmCC')
+IMAGE = f'data:image/png;base64,{PIXEL}'
+# Словарь для названий и описаний рецептов, по которым работает поиск.
+WORDS = ('суп', 'томатный', 'куриный', 'салат', 'пирог', 'яблочный',
+         'сырный', 'запечённый', 'жареный', 'картофель', 'грибы', 'сливки',
+         'чеснок', 'лук', 'морковь', 'рис', 'паста', 'соус', 'острый',
+         'домашний')
+SEARCH_QUERY = 'томатный суп'
+
+SCENARIOS = {}
+
+
+def scenario(name, fixture=None):
+    """Регистрирует функцию сценария под именем эндпоинта.
+
+    ``fixture`` — контекстный менеджер ``fixture(ctx)``, создающий данные
+    сценария на время прогона его группы (см. ``run``).
+    """
+    def decorator(func):
+        func.fixture = fixture
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+class BenchmarkContext:
+    """Данные, созданные при наполнении базы и нужные сценариям"""
+
+    def __init__(self, user, authors, free_author, recipes, ingredients,
+                 tags, page_size):
+        self.user = user
+        self.authors = authors
+        self.free_author = free_author
+        self.recipes = recipes
+        self.ingredients = ingredients
+        self.tags = tags
+        self.page_size = page_size
+        self.client = APIClient(raise_request_exception=False)
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.anonymous = APIClient(raise_request_exception=False)
+        self.own_recipe = Recipe.objects.filter(author=user).first()
+        self.free_recipe = Recipe.objects.exclude(
+            favorite__user=user).exclude(cart__user=user).first()
+        self.pantry = ingredients[:10]
+        word = 'Ингредиент 12'
+        self.keystrokes = cycle(word[:end] for end in range(1, len(word) + 1))
+
+    def recipe_payload(self, ingredients_count, image=IMAGE):
+        return {
+            'name': 'Рецепт для замера',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': image,
+            'tags': [tag.id for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:ingredients_count]
+            ],
+        }
+
+
+def seed(users=50, recipes=500, ingredients=300, ingredients_per_recipe=8,
+         tags=5, favorites=30, carts=15, subscriptions=20, page_size=6,
+         random_seed=0):
+    """Наполняет базу синтетическими данными.
+
+    ``favorites``, ``carts`` и ``subscriptions`` задаются на пользователя.
+    Первый созданный пользователь используется для авторизованных запросов.
+    """
+    rnd = random.Random(random_seed)
+    password = make_password('benchmark-password')
+    User.objects.bulk_create(
+        User(
+            username=f'bench_{number}',
+            email=f'bench_{number}@example.com',
+            first_name='Имя',
+            last_name='Фамилия',
+            password=password,
+        ) for number in range(users)
+    )
+    user_ids = list(User.objects.filter(
+        username__startswith='bench_').values_list('id', flat=True))
+    Tag.objects.bulk_create(
+        Tag(name=f'Тег {number}', color=Tag.COLOR_CHOICES[
+            number % len(Tag.COLOR_CHOICES)][0], slug=f'bench_{number}')
+        for number in range(tags)
+    )
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+        for number in range(ingredients)
+    )
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    Recipe.objects.bulk_create(
+        Recipe(
+            author_id=user_ids[number % len(user_ids)],
+            name=f'{rnd.choice(WORDS).capitalize()} {rnd.choice(WORDS)} '
+                 f'{number}',
+            text=' '.join(rnd.choices(WORDS, k=40)),
+            cooking_time=rnd.randint(1, 120),
+            image='media/temp.jpeg',
+        ) for number in range(recipes)
+    )
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=rnd.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in rnd.sample(
+            ingredient_ids, min(ingredients_per_recipe, len(ingredient_ids)))
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in rnd.sample(tag_ids, min(2, len(tag_ids)))
+    )
+    for model, per_user in ((Favorite, favorites), (Cart, carts)):
+        model.objects.bulk_create(
+            model(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in rnd.sample(
+                recipe_ids, min(per_user, len(recipe_ids)))
+        )
+    ShoppingListItem.objects.apply_deltas(
+        ShoppingListItem.objects.expected_totals())
+    Subscription.objects.bulk_create(
+        Subscription(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in rnd.sample(
+            user_ids, min(subscriptions + 1, len(user_ids)))
+        if author_id != user_id
+    )
+    # Автор без подписчиков для сценариев подписки: при малом числе
+    # пользователей на всех остальных подписан каждый.
+    free_author = User.objects.create(
+        username='bench_free_author', email='bench_free_author@example.com',
+        first_name='Имя', last_name='Фамилия', password=password)
+    call_command('repair_counters', stdout=StringIO())
+    seed_images(recipe_ids)
+    index_recipes(recipe_ids)
+    rebuild_timelines()
+    # Записи кеша ответов от прошлых прогонов ссылаются на те же id.
+    recipe_responses.clear()
+    user = User.objects.get(pk=user_ids[0])
+    return BenchmarkContext(
+        user=user,
+        authors=User.objects.exclude(pk=user.pk),
+        free_author=free_author,
+        recipes=recipe_ids,
+        ingredients=list(Ingredient.objects.all()),
+        tags=list(Tag.objects.all()),
+        page_size=page_size,
+    )
+
+
+def sample_photo():
+    """JPEG 1200x900 с шумом, по размеру близкий к фотографии блюда."""
+    buffer = BytesIO()
+    Image.effect_noise((1200, 900), 40).convert('RGB').save(
+        buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def seed_images(recipe_ids):
+    """Назначает всем рецептам одно настоящее изображение с готовой
+    уменьшенной копией."""
+    photo = sample_photo()
+    name = Recipe._meta.get_field('image').storage.save(
+        'media/photo.jpg', ContentFile(photo))
+    Recipe.objects.filter(pk__in=recipe_ids).update(image=name)
+    make_thumbnail(recipe_ids[0], name)
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        thumbnail=Recipe.objects.get(pk=recipe_ids[0]).thumbnail.name)
+
+
+def response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1,
+                       round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(func, ctx):
+    """Выполняет сценарий один раз и возвращает метрики запроса."""
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = func(ctx)
+        size = response_size(response)
+        elapsed = time.perf_counter() - started
+    return response.status_code, len(queries), elapsed, size
+
+
+def run(ctx, repeat=20, warmup=2, names=None):
+    """Прогоняет сценарии ``repeat`` раз и агрегирует результаты.
+
+    Сценарии выполняются по очереди в порядке регистрации, поэтому пары
+    «добавить/удалить» оставляют базу в исходном состоянии. Подряд идущие
+    сценарии с общей фикстурой прогоняются отдельной группой внутри неё,
+    и её данные не видны остальным сценариям.
+    """
+    selected = [
+        (name, func) for name, func in SCENARIOS.items()
+        if not names or name in names
+    ]
+    samples = {name: [] for name, _ in selected}
+    for fixture, group in groupby(selected, key=lambda item: item[1].fixture):
+        group = list(group)
+        with fixture(ctx) if fixture is not None else nullcontext():
+            for iteration in range(warmup + repeat):
+                for name, func in group:
+                    sample = measure(func, ctx)
+                    if iteration >= warmup:
+                        samples[name].append(sample)
+    results = {}
+    for name, rows in samples.items():
+        timings = [row[2] * 1000 for row in rows]
+        results[name] = {
+            'status': rows[-1][0],
+            'queries': max(row[1] for row in rows),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p90_ms': round(percentile(timings, 90), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'bytes': rows[-1][3],
+        }
+    return results
+
+
+def compare(baseline, current, threshold=0.2, query_threshold=0.0):
+    """Возвращает список регрессий относительно сохранённого прогона."""
+    regressions = []
+    for name, before in baseline.items():
+        after = current.get(name)
+        if after is None:
+            continue
+        if after['queries'] > before['queries'] * (1 + query_threshold):
+            regressions.append(
+                f'{name}: запросов {before["queries"]} -> '
+                f'{after["queries"]}')
+        if after['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            regressions.append(
+                f'{name}: p50 {before["p50_ms"]} мс -> '
+                f'{after["p50_ms"]} мс')
+    return regressions
+
+
+@scenario('recipes-list')
+def recipes_list(ctx):
+    return ctx.client.get('/api/recipes/', {'limit': ctx.page_size})
+
+
+def instrumented_client(ctx):
+    """Клиент, запросы которого проходят через замеры
+    ``api.instrumentation`` (middleware подключается при загрузке цепочки
+    обработчиков)."""
+    if not hasattr(ctx, 'instrumented'):
+        ctx.instrumented = APIClient(raise_request_exception=False)
+        token = Token.objects.get(user=ctx.user)
+        ctx.instrumented.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        with override_settings(INSTRUMENTATION=True):
+            ctx.instrumented.handler.load_middleware()
+    return ctx.instrumented
+
+
+@scenario('recipes-list-instrumented')
+def recipes_list_instrumented(ctx):
+    return instrumented_client(ctx).get(
+        '/api/recipes/', {'limit': ctx.page_size})
+
+
+@scenario('metrics')
+def metrics_endpoint(ctx):
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
+
+
+@scenario('recipes-list-anonymous')
+def recipes_list_anonymous(ctx):
+    return ctx.anonymous.get('/api/recipes/', {'limit': ctx.page_size})
+
+
+@scenario('recipes-list-anonymous-miss')
+def recipes_list_anonymous_miss(ctx):
+    recipe_responses.invalidate(['list'])
+    return ctx.anonymous.get('/api/recipes/', {'limit': ctx.page_size})
+
+
+@scenario('recipes-list-anonymous-hit')
+def recipes_list_anonymous_hit(ctx):
+    return ctx.anonymous.get('/api/recipes/', {'limit': ctx.page_size})
+
+
+@scenario('recipes-list-filtered')
+def recipes_list_filtered(ctx):
+    return ctx.client.get('/api/recipes/', {
+        'limit': ctx.page_size,
+        'tags': [tag.slug for tag in ctx.tags[:2]],
+        'is_favorited': 1,
+    })
+
+
+@scenario('recipes-search')
+def recipes_search(ctx):
+    return ctx.client.get('/api/recipes/', {
+        'limit': ctx.page_size, 'search': SEARCH_QUERY})
+
+
+def search_page(queryset, page_size):
+    """Количество найденных рецептов и id первой страницы."""
+    return JsonResponse({
+        'count': queryset.count(),
+        'results': list(queryset.values_list('id', flat=True)[:page_size]),
+    })
+
+
+@scenario('search-icontains')
+def search_icontains(ctx):
+    """Поиск подстрокой по названию, описанию и ингредиентам без индекса
+    (для сравнения с search-index)."""
+    queryset = Recipe.objects.all()
+    for word in SEARCH_QUERY.split():
+        queryset = queryset.filter(
+            Q(name__icontains=word) | Q(text__icontains=word)
+            | Q(ingredients__ingredient__name__icontains=word)
+        )
+    return search_page(queryset.distinct().order_by('-id'), ctx.page_size)
+
+
+@scenario('search-index')
+def search_index(ctx):
+    return search_page(search_recipes(Recipe.objects.all(), SEARCH_QUERY),
+                       ctx.page_size)
+
+
+@scenario('recipes-cookable')
+def recipes_cookable(ctx):
+    return ctx.client.get('/api/recipes/cookable/', {
+        'limit': ctx.page_size,
+        'ingredients': [ingredient.id for ingredient in ctx.pantry],
+    })
+
+
+@scenario('cookable-naive')
+def cookable_naive(ctx):
+    """Подбор рецептов агрегацией по RecipeIngredient в базе (для сравнения
+    с cookable-index)."""
+    pantry = [ingredient.id for ingredient in ctx.pantry]
+    queryset = Recipe.objects.annotate(
+        total=Count('ingredients'),
+        matched=Count('ingredients',
+                      filter=Q(ingredients__ingredient_id__in=pantry)),
+    ).filter(matched__gt=0).annotate(
+        coverage=ExpressionWrapper(F('matched') * 1.0 / F('total'),
+                                   output_field=FloatField()),
+    ).order_by('-coverage', F('total') - F('matched'), '-id')
+    return search_page(queryset, ctx.page_size)
+
+
+@scenario('cookable-index')
+def cookable_index(ctx):
+    ranked = get_matcher().match(
+        [ingredient.id for ingredient in ctx.pantry])
+    return JsonResponse({
+        'count': len(ranked),
+        'results': [row[0] for row in ranked[:ctx.page_size]],
+    })
+
+
+@scenario('recipes-list-popular')
+def recipes_list_popular(ctx):
+    return ctx.client.get('/api/recipes/', {
+        'limit': ctx.page_size, 'ordering': '-favorites_count'})
+
+
+@scenario('recipes-page-first')
+def recipes_page_first(ctx):
+    return ctx.client.get('/api/recipes/', {'limit': ctx.page_size})
+
+
+@scenario('recipes-page-deep')
+def recipes_page_deep(ctx):
+    """Последняя страница при пагинации через OFFSET."""
+    return ctx.client.get('/api/recipes/', {
+        'limit': ctx.page_size,
+        'page': max(1, (len(ctx.recipes) - 1) // ctx.page_size + 1)
+    })
+
+
+@scenario('recipes-cursor-first')
+def recipes_cursor_first(ctx):
+    return ctx.client.get('/api/recipes/', {
+        'limit': ctx.page_size, 'pagination': 'cursor'})
+
+
+@scenario('recipes-cursor-deep')
+def recipes_cursor_deep(ctx):
+    """Та же глубина, что и в recipes-page-deep, но через курсор."""
+    position = sorted(ctx.recipes)[min(ctx.page_size, len(ctx.recipes) - 1)]
+    cursor = b64encode(f'p={position}'.encode()).decode()
+    return ctx.client.get('/api/recipes/', {
+        'limit': ctx.page_size, 'cursor': cursor})
+
+
+@scenario('recipes-page-images')
+def recipes_page_images(ctx):
+    """Байты изображений, которые клиент скачает для одной страницы
+    списка: размер ответа — сумма размеров файлов по ссылкам."""
+    response = ctx.client.get('/api/recipes/', {'limit': ctx.page_size})
+    storage = Recipe._meta.get_field('image').storage
+    content = b''.join(
+        storage.open(recipe['image'].split(settings.MEDIA_URL, 1)[1]).read()
+        for recipe in response.json()['results'] if recipe['image']
+    )
+    return HttpResponse(content, status=response.status_code)
+
+
+@scenario('recipes-detail')
+def recipes_detail(ctx):
+    return ctx.client.get(f'/api/recipes/{ctx.recipes[0]}/')
+
+
+@scenario('recipes-detail-anonymous')
+def recipes_detail_anonymous(ctx):
+    return ctx.anonymous.get(f'/api/recipes/{ctx.recipes[1]}/')
+
+
+def between_requests(ctx, reconnect):
+    """Запрос рецепта после обработки соединения, как между запросами
+    сервера (тестовый клиент Django соединения не закрывает).
+
+    ``reconnect`` — соединение закрыто, как при ``CONN_MAX_AGE=0`` (с
+    пулом оно возвращается в пул); иначе оно остаётся открытым и
+    проверяется. Для SQLite нужна файловая тестовая база
+    (``DB_TEST_NAME``): соединение с базой в памяти не закрывается."""
+    if reconnect:
+        connection.close()
+    else:
+        close_old_connections()
+    return ctx.client.get(f'/api/recipes/{ctx.recipes[0]}/')
+
+
+@scenario('connection-per-request')
+def connection_per_request(ctx):
+    return between_requests(ctx, reconnect=True)
+
+
+@scenario('connection-persistent')
+def connection_persistent(ctx):
+    return between_requests(ctx, reconnect=False)
+
+
+@scenario('recipes-create')
+def recipes_create(ctx):
+    return ctx.client.post('/api/recipes/', ctx.recipe_payload(10),
+                           format='json')
+
+
+def photo_payload(ctx):
+    """Тело запроса на создание рецепта с фотографией 1200x900."""
+    if not hasattr(ctx, 'photo'):
+        ctx.photo = 'data:image/jpeg;base64,' + b64encode(
+            sample_photo()).decode()
+    if not hasattr(ctx, 'photo_body'):
+        ctx.photo_body = JSONRenderer().render(
+            ctx.recipe_payload(10, ctx.photo))
+    return ctx.photo_body
+
+
+def list_data(ctx):
+    """Данные страницы из 100 рецептов, сериализованные один раз."""
+    if not hasattr(ctx, 'list_data'):
+        ctx.list_data = ctx.client.get('/api/recipes/', {'limit': 100}).data
+    return ctx.list_data
+
+
+@scenario('recipes-create-photo')
+def recipes_create_photo(ctx):
+    """Создание рецепта с фотографией 1200x900 вместо пикселя."""
+    return ctx.client.post('/api/recipes/', photo_payload(ctx),
+                           content_type='application/json')
+
+
+@scenario('recipes-list-100')
+def recipes_list_100(ctx):
+    return ctx.client.get('/api/recipes/', {'limit': 100})
+
+
+@scenario('render-list-100-json')
+def render_list_100_json(ctx):
+    """Только кодирование страницы из 100 рецептов стандартным json."""
+    return HttpResponse(JSONRenderer().render(list_data(ctx)))
+
+
+@scenario('render-list-100-fast')
+def render_list_100_fast(ctx):
+    return HttpResponse(FastJSONRenderer().render(list_data(ctx)))
+
+
+@scenario('parse-photo-json')
+def parse_photo_json(ctx):
+    """Только разбор тела запроса с фотографией стандартным json."""
+    body = photo_payload(ctx)
+    JSONParser().parse(BytesIO(body))
+    return HttpResponse(body)
+
+
+@scenario('parse-photo-fast')
+def parse_photo_fast(ctx):
+    body = photo_payload(ctx)
+    FastJSONParser().parse(BytesIO(body))
+    return HttpResponse(body)
+
+
+@scenario('recipes-patch')
+def recipes_patch(ctx):
+    return ctx.client.patch(f'/api/recipes/{ctx.own_recipe.id}/',
+                            ctx.recipe_payload(10), format='json')
+
+
+@scenario('recipes-patch-50')
+def recipes_patch_50(ctx):
+    """PATCH рецепта с 50 ингредиентами: запросы чередуют два состава,
+    различающиеся количеством пяти ингредиентов и ещё пятью ингредиентами."""
+    ctx.patch_round = getattr(ctx, 'patch_round', 0) + 1
+    shift = ctx.patch_round % 2
+    payload = ctx.recipe_payload(0)
+    ingredients = (ctx.ingredients[:45]
+                   + ctx.ingredients[45 + 5 * shift:50 + 5 * shift])
+    payload['ingredients'] = [
+        {'id': ingredient.id, 'amount': 10 + shift * (number < 5)}
+        for number, ingredient in enumerate(ingredients)
+    ]
+    return ctx.client.patch(f'/api/recipes/{ctx.own_recipe.id}/', payload,
+                            format='json')
+
+
+@scenario('favorite-add')
+def favorite_add(ctx):
+    return ctx.client.post(f'/api/recipes/{ctx.free_recipe.id}/favorite/')
+
+
+@scenario('favorite-delete')
+def favorite_delete(ctx):
+    return ctx.client.delete(f'/api/recipes/{ctx.free_recipe.id}/favorite/')
+
+
+@scenario('shopping-cart-add')
+def shopping_cart_add(ctx):
+    return ctx.client.post(
+        f'/api/recipes/{ctx.free_recipe.id}/shopping_cart/')
+
+
+@scenario('shopping-cart-delete')
+def shopping_cart_delete(ctx):
+    return ctx.client.delete(
+        f'/api/recipes/{ctx.free_recipe.id}/shopping_cart/')
+
+
+@scenario('download-shopping-cart')
+def download_shopping_cart(ctx):
+    return ctx.client.get('/api/recipes/download_shopping_cart/')
+
+
+@scenario('download-shopping-cart-csv')
+def download_shopping_cart_csv(ctx):
+    return ctx.client.get('/api/recipes/download_shopping_cart/',
+                          {'type': 'csv'})
+
+
+@scenario('users-list')
+def users_list(ctx):
+    return ctx.client.get('/api/users/', {'limit': ctx.page_size})
+
+
+@scenario('users-me')
+def users_me(ctx):
+    return ctx.client.get('/api/users/me/')
+
+
+@scenario('users-me-uncached')
+def users_me_uncached(ctx):
+    """Тот же запрос с промахом кеша токенов."""
+    token_cache.clear()
+    return ctx.client.get('/api/users/me/')
+
+
+@scenario('users-subscriptions')
+def users_subscriptions(ctx):
+    return ctx.client.get('/api/users/subscriptions/', {
+        'limit': ctx.page_size, 'recipes_limit': 3})
+
+
+@scenario('subscribe')
+def subscribe(ctx):
+    return ctx.client.post(f'/api/users/{ctx.free_author.id}/subscribe/')
+
+
+@scenario('unsubscribe')
+def unsubscribe(ctx):
+    return ctx.client.delete(f'/api/users/{ctx.free_author.id}/subscribe/')
+
+
+@scenario('subscriptions-list')
+def subscriptions_list(ctx):
+    return ctx.client.get('/api/subscriptions/')
+
+
+@contextmanager
+def feed_reader(ctx, authors=1000, recipes_per_author=20, newer=5000):
+    """Читатель ленты (``ctx.reader``), подписанный на ``authors``
+    авторов; они, в свою очередь, подписаны на него. Один из авторов
+    популярен настолько, что его рецепты читаются при запросе ленты, а не
+    из таблицы. После рецептов ленты публикуется ``newer`` рецептов других
+    авторов.
+
+    Созданные пользователи и рецепты (в том числе опубликованные
+    сценариями) удаляются на выходе, счётчики и ленты пересчитываются.
+    """
+    last_user = User.objects.order_by('-pk').values_list('pk', flat=True)[0]
+    last_recipe = Recipe.objects.order_by('-pk').values_list(
+        'pk', flat=True)[0]
+    # Рецептам нужно существующее изображение: его читают сценарии
+    # с оригиналами изображений.
+    image, thumbnail = Recipe.objects.filter(pk=ctx.recipes[0]).values_list(
+        'image', 'thumbnail').get()
+    password = make_password('benchmark-password')
+    reader = User.objects.create(
+        username='feed_reader', email='feed_reader@example.com',
+        first_name='Имя', last_name='Фамилия', password=password)
+    User.objects.bulk_create(
+        User(username=f'feed_{number}', email=f'feed_{number}@example.com',
+             first_name='Имя', last_name='Фамилия', password=password)
+        for number in range(authors)
+    )
+    author_ids = list(User.objects.filter(
+        username__startswith='feed_').exclude(pk=reader.pk).values_list(
+        'id', flat=True))
+    Recipe.objects.bulk_create(
+        Recipe(author_id=author_id, name=f'Рецепт ленты {number}',
+               text='Описание', cooking_time=10, image=image,
+               thumbnail=thumbnail)
+        for number in range(recipes_per_author)
+        for author_id in author_ids
+    )
+    other_ids = list(User.objects.filter(
+        username__startswith='bench_').values_list('id', flat=True))
+    Recipe.objects.bulk_create(
+        Recipe(author_id=other_ids[number % len(other_ids)],
+               name=f'Рецепт вне ленты {number}', text='Описание',
+               cooking_time=10, image=image, thumbnail=thumbnail)
+        for number in range(newer)
+    )
+    Subscription.objects.bulk_create(
+        [Subscription(user=reader, author_id=author_id)
+         for author_id in author_ids]
+        + [Subscription(user_id=author_id, author=reader)
+           for author_id in author_ids]
+    )
+    call_command('repair_counters', stdout=StringIO())
+    User.objects.filter(pk=author_ids[0]).update(
+        followers_count=settings.FEED_FANOUT_LIMIT + 1)
+    rebuild_timelines()
+    ctx.reader = APIClient(raise_request_exception=False)
+    token, _ = Token.objects.get_or_create(user=reader)
+    ctx.reader.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    ctx.reader.user = reader
+    ctx.reader.middle = feed_recipe_ids(reader, authors)[-1]
+    try:
+        yield
+    finally:
+        del ctx.reader
+        Recipe.objects.filter(pk__gt=last_recipe).delete()
+        User.objects.filter(pk__gt=last_user).delete()
+        call_command('repair_counters', stdout=StringIO())
+        rebuild_timelines()
+        recipe_responses.clear()
+
+
+@scenario('recipes-feed', fixture=feed_reader)
+def recipes_feed(ctx):
+    """Лента читателя, подписанного на 1000 авторов."""
+    return ctx.reader.get('/api/recipes/feed/', {'limit': ctx.page_size})
+
+
+@scenario('recipes-feed-deep', fixture=feed_reader)
+def recipes_feed_deep(ctx):
+    reader = ctx.reader
+    return reader.get('/api/recipes/feed/', {
+        'limit': ctx.page_size, 'before': reader.middle})
+
+
+@scenario('feed-timeline', fixture=feed_reader)
+def feed_timeline(ctx):
+    """Только выбор id первой страницы ленты из таблицы лент."""
+    return JsonResponse(
+        {'results': feed_recipe_ids(ctx.reader.user, ctx.page_size)})
+
+
+@scenario('feed-naive', fixture=feed_reader)
+def feed_naive(ctx):
+    """То же без таблицы лент: рецепты всех авторов из подписок."""
+    return JsonResponse({'results': list(Recipe.objects.filter(
+        author__in=Subscription.objects.filter(
+            user=ctx.reader.user).values('author')
+    ).order_by('-pk').values_list('pk', flat=True)[:ctx.page_size])})
+
+
+@scenario('recipes-create-fanout', fixture=feed_reader)
+def recipes_create_fanout(ctx):
+    """Публикация рецепта автором с 1000 подписчиков."""
+    return ctx.reader.post(
+        '/api/recipes/', ctx.recipe_payload(10), format='json')
+
+
+@scenario('ingredients-search')
+def ingredients_search(ctx):
+    return ctx.client.get('/api/ingredients/', {'name': 'Ингредиент 1'})
+
+
+@scenario('ingredients-autocomplete')
+def ingredients_autocomplete(ctx):
+    """Один запрос на каждое нажатие клавиши при наборе названия."""
+    return ctx.client.get('/api/ingredients/autocomplete/',
+                          {'name': next(ctx.keystrokes)})
+
+
+@scenario('tags-list')
+def tags_list(ctx):
+    return ctx.client.get('/api/tags/')
+
+
+@scenario('tags-detail')
+def tags_detail(ctx):
+    return ctx.client.get(f'/api/tags/{ctx.tags[0].id}/')
@@ -0,0 +1,197 @@
+"""Кеш справочников (теги и ингредиенты).
+
+Готовый JSON хранится в памяти процесса, а номер версии справочника — в
+общем кеше Django, поэтому изменение каталога в одном процессе (админка,
+команды ``load_tags``/``load_ingredients``) сбрасывает копии во всех
+остальных. Ответы отдаются со строгим ETag.
+
+Там же — кеш готовых ответов API для анонимных пользователей
+(``ResponseCache``) с точечной инвалидацией по зависимостям.
+"""
+import hashlib
+from collections import Counter
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from foodgram.db.transaction import OnCommitBatch
+from .renderers import FastJSONRenderer
+
+
+class CatalogCache:
+    """Версионируемый кеш сериализованного справочника"""
+
+    def __init__(self, name):
+        self.name = name
+        self.version_key = f'catalog:{name}:version'
+        self._local = {}
+
+    def version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # Случайная версия не совпадёт с уже лежащими в памяти копиями,
+            # даже если ключ был вытеснен из общего кеша.
+            cache.add(self.version_key, uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        cache.set(self.version_key, uuid4().hex, None)
+        self._local.clear()
+
+    def get(self, variant, build):
+        """Возвращает ``(content, etag)`` для варианта справочника,
+        сериализуя данные через ``build`` только при смене версии."""
+        version = self.version()
+        entry = self._local.get(variant)
+        if entry is None or entry[0] != version:
+            content = FastJSONRenderer().render(build())
+            etag = f'"{hashlib.sha1(content).hexdigest()}"'
+            entry = self._local[variant] = (version, content, etag)
+        return entry[1], entry[2]
+
+    def response(self, request, variant, build):
+        content, etag = self.get(variant, build)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+tags_catalog = CatalogCache('tags')
+ingredients_catalog = CatalogCache('ingredients')
+
+
+class ResponseCache:
+    """Кеш готовых ответов с зависимостями.
+
+    Каждая запись хранит версии зависимостей (``recipe:<id>``,
+    ``user:<id>``, ``list:tag:<slug>`` и т. п.), действовавшие при её
+    создании. Изменение данных удаляет ключи версий затронутых
+    зависимостей, и при следующем чтении записи с ними считаются
+    устаревшими; остальные записи продолжают отдаваться из кеша.
+
+    Хранилище задаётся настройкой ``RESPONSE_CACHE`` (алиас из
+    ``CACHES``), число попаданий и промахов процесса — в ``stats``.
+    """
+    generation = 'generation'
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.stats = Counter()
+
+    @property
+    def cache(self):
+        return caches[settings.RESPONSE_CACHE]
+
+    def version_key(self, dependency):
+        return f'{self.prefix}:version:{dependency}'
+
+    def versions(self, dependencies):
+        """Текущие версии зависимостей; недостающие создаются."""
+        keys = [self.version_key(name) for name in dependencies]
+        versions = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            for key in missing:
+                self.cache.add(key, uuid4().hex, None)
+            versions.update(self.cache.get_many(missing))
+        return versions
+
+    def invalidate(self, dependencies):
+        self.cache.delete_many(
+            [self.version_key(name) for name in dependencies])
+
+    def clear(self):
+        """Делает устаревшими все записи."""
+        self.invalidate([self.generation])
+
+    def hit_rate(self):
+        total = self.stats['hit'] + self.stats['miss']
+        return self.stats['hit'] / total if total else 0.0
+
+    def lookup(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        versions, content, etag = entry
+        if self.cache.get_many(list(versions)) != versions:
+            self.stats['stale'] += 1
+            return None
+        return content, etag
+
+    def response(self, request, variant, build, dependencies=()):
+        """Ответ для варианта ``variant`` (кортеж строк).
+
+        ``build`` возвращает данные ответа и список зависимостей, ставших
+        известными из данных. Версии заранее известных ``dependencies``
+        читаются до построения ответа, чтобы изменение, зафиксированное
+        во время построения, не попало в кеш под новой версией.
+        """
+        key = f'{self.prefix}:' + hashlib.sha1('\n'.join(
+            (request.scheme, request.get_host(), *variant)
+        ).encode()).hexdigest()
+        entry = self.lookup(key)
+        if entry is None:
+            self.stats['miss'] += 1
+            versions = self.versions([self.generation, *dependencies])
+            data, found = build()
+            content = FastJSONRenderer().render(data)
+            etag = f'"{hashlib.sha1(content).hexdigest()}"'
+            versions.update(self.versions(set(found) - set(dependencies)))
+            self.cache.set(key, (versions, content, etag),
+                           settings.RESPONSE_CACHE_TIMEOUT)
+            status = 'MISS'
+        else:
+            self.stats['hit'] += 1
+            content, etag = entry
+            status = 'HIT'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        response['X-Cache'] = status
+        return response
+
+
+class PendingInvalidation(OnCommitBatch):
+    """Зависимости, изменённые в текущей транзакции"""
+
+    def process(self, dependencies):
+        recipe_responses.invalidate(dependencies)
+
+
+def schedule_invalidation(dependencies, using='default'):
+    """Сбрасывает записи кеша ответов после фиксации транзакции, одним
+    обращением к кешу на транзакцию."""
+    PendingInvalidation.add(dependencies, using)
+
+
+def recipe_dependencies(recipes):
+    """Зависимости сериализованных рецептов: сами рецепты и их авторы.
+    От справочников тегов и ингредиентов зависит любой ответ с рецептами
+    (``CATALOG_DEPENDENCIES``)."""
+    dependencies = set()
+    for recipe in recipes:
+        dependencies.add(f'recipe:{recipe["id"]}')
+        dependencies.add(f'user:{recipe["author"]["id"]}')
+    return dependencies
+
+
+def list_dependencies(author=None, tags=()):
+    """Зависимость состава списка рецептов от добавления, удаления и смены
+    тегов рецептов."""
+    if author is not None:
+        return [f'list:author:{author}']
+    if tags:
+        return [f'list:tag:{slug}' for slug in tags]
+    return ['list']
+
+
+CATALOG_DEPENDENCIES = ('catalog:tags', 'catalog:ingredients')
+recipe_responses = ResponseCache('responses:recipes')
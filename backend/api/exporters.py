@@ -0,0 +1,75 @@
+import csv
+import hashlib
+
+from django.utils.html import escape
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListExporter:
+    """Базовый класс выгрузки списка покупок.
+
+    ``render`` принимает итератор строк (название, единица измерения,
+    количество) и отдаёт файл по частям, не собирая его в памяти целиком.
+    """
+    content_type = None
+    extension = None
+
+    def render(self, rows):
+        raise NotImplementedError
+
+    def etag(self, rows):
+        digest = hashlib.sha1(self.extension.encode())
+        for name, measurement_unit, amount in rows:
+            digest.update(f'{name}\0{measurement_unit}\0{amount}\n'.encode())
+        return f'"{digest.hexdigest()}"'
+
+
+class TextExporter(ShoppingListExporter):
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def render(self, rows):
+        for name, measurement_unit, amount in rows:
+            yield f'{name} {amount} - {measurement_unit}\r\n'
+
+
+class CsvExporter(ShoppingListExporter):
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def render(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения'))
+        for name, measurement_unit, amount in rows:
+            yield writer.writerow((name, amount, measurement_unit))
+
+
+class PdfExporter(ShoppingListExporter):
+    """PDF собирается weasyprint целиком, поэтому отдаётся одной частью."""
+    content_type = 'application/pdf'
+    extension = 'pdf'
+
+    def render(self, rows):
+        from weasyprint import HTML
+
+        items = ''.join(
+            f'<li>{escape(name)} — {amount} {escape(measurement_unit)}</li>'
+            for name, measurement_unit, amount in rows
+        )
+        return [HTML(string=(
+            '<html><head><meta charset="utf-8"></head><body>'
+            f'<h1>Список покупок</h1><ul>{items}</ul></body></html>'
+        )).write_pdf()]
+
+
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (TextExporter, CsvExporter, PdfExporter)
+}
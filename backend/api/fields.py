@@ -1,14 +1,102 @@
 import base64
+import binascii
+from io import BytesIO
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
 from rest_framework import serializers
+from rest_framework.relations import (MANY_RELATION_KWARGS, ManyRelatedField,
+                                      PrimaryKeyRelatedField)
+
+# Размер порции base64 для декодирования, кратен 4 символам.
+DECODE_CHUNK_SIZE = 64 * 1024
 
 
 class Base64ImageField(serializers.ImageField):
     """Сериалайзер для изображений"""
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} '
+                     'байт.',
+        'invalid_base64': 'Изображение должно быть закодировано в base64.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(imgstr, 'temp.' + ext, format[len('data:'):])
         return super().to_internal_value(data)
+
+    def decode(self, imgstr, name, content_type):
+        """Декодирует base64 порциями, не создавая вторую копию изображения
+        в памяти; большие файлы, как и обычные загрузки Django, пишутся во
+        временный файл на диске."""
+        max_size = settings.MAX_IMAGE_UPLOAD_SIZE
+        if len(imgstr) // 4 * 3 > max_size:
+            self.fail('too_large', max_size=max_size)
+        if len(imgstr) // 4 * 3 > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            upload = TemporaryUploadedFile(name, content_type, 0, None)
+        else:
+            upload = InMemoryUploadedFile(
+                BytesIO(), None, name, content_type, 0, None)
+        try:
+            for start in range(0, len(imgstr), DECODE_CHUNK_SIZE):
+                upload.file.write(base64.b64decode(
+                    imgstr[start:start + DECODE_CHUNK_SIZE], validate=True))
+        except (binascii.Error, ValueError):
+            self.fail('invalid_base64')
+        upload.size = upload.file.tell()
+        upload.file.seek(0)
+        return upload
+
+
+class ThumbnailImageField(serializers.ImageField):
+    """Отдаёт уменьшенную копию изображения, если она уже готова.
+
+    Оригинал возвращается, если в контексте сериализатора передан
+    ``original_images=True`` или копия ещё не создана.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        thumbnail = getattr(instance, 'thumbnail', None)
+        if thumbnail and not self.context.get('original_images'):
+            return thumbnail
+        return super().get_attribute(instance)
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    """Список первичных ключей, который проверяется одним запросом"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in data))
+        except (TypeError, ValueError):
+            child.fail('incorrect_type', data_type=type(data).__name__)
+        objects = child.get_queryset().in_bulk(ids)
+        for pk in ids:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in ids]
+
+
+class BulkPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, у которого ``many=True`` проверяет все
+    значения одним запросом ``in_bulk``."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
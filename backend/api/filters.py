@@ -1,10 +1,35 @@
+from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Ingredient, Recipe
+from recipes.models import Cart, Favorite, Ingredient, Recipe
+from recipes.search import search_recipes
+from .autocomplete import rank_by_prefix
+
+
+class SlugListField(forms.Field):
+    """Список значений из повторяющегося параметра (?tags=a&tags=b).
+
+    В отличие от AllValuesMultipleFilter не строит список допустимых
+    значений запросом к базе на каждый запрос.
+    """
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        return [slug for slug in value or () if slug]
+
+
+class SlugListFilter(filters.Filter):
+    field_class = SlugListField
 
 
 class RecipeFilter(FilterSet):
-    """Фильтры для рецептов"""
+    """Фильтры для рецептов.
+
+    Все условия накладываются на один queryset через EXISTS-подзапросы,
+    поэтому рецепты не дублируются и DISTINCT не нужен.
+    """
     is_favorited = filters.BooleanFilter(
         field_name='is_favorited',
         method='favorite_filter'
@@ -13,22 +38,60 @@ class RecipeFilter(FilterSet):
         field_name='is_in_shopping_cart',
         method='shopping_cart_filter'
     )
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = SlugListFilter(method='tags_filter')
+    min_favorites = filters.NumberFilter(field_name='favorites_count',
+                                         lookup_expr='gte')
+    search = filters.CharFilter(method='search_filter')
+
+    def user_relation_filter(self, queryset, name, model, value):
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none() if value else queryset
+        # Флаг уже может быть аннотирован RecipeQuerySet.with_user_flags.
+        if name in queryset.query.annotations:
+            return queryset.filter(**{name: value})
+        relation = Exists(model.objects.filter(user=user,
+                                               recipe=OuterRef('pk')))
+        return queryset.filter(relation if value else ~relation)
 
     def favorite_filter(self, queryset, name, value):
-        return Recipe.objects.filter(favorite__user=self.request.user)
+        return self.user_relation_filter(queryset, name, Favorite, value)
 
     def shopping_cart_filter(self, queryset, name, value):
-        return Recipe.objects.filter(cart__user=self.request.user)
+        return self.user_relation_filter(queryset, name, Cart, value)
+
+    def tags_filter(self, queryset, name, value):
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__slug__in=value)))
+
+    def search_filter(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
     class Meta:
         model = Recipe
         fields = ['name', 'author']
 
 
+class RecipeOrderingFilter(OrderingFilter):
+    """Сортировка рецептов.
+
+    Результаты поиска без явного ``?ordering=`` остаются упорядоченными по
+    релевантности, а не по умолчанию вьюсета.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if ('search_rank' in queryset.query.annotations
+                and self.ordering_param not in request.query_params):
+            return queryset
+        return super().filter_queryset(request, queryset, view)
+
+
 class IngredientSearchFilter(FilterSet):
     """Фильтр для поиска ингредиентов при создании рецепта"""
-    name = filters.CharFilter(field_name='name', lookup_expr='icontains')
+    name = filters.CharFilter(method='name_filter')
+
+    def name_filter(self, queryset, name, value):
+        return rank_by_prefix(queryset, value)
 
     class Meta:
         model = Ingredient
@@ -0,0 +1,70 @@
+"""Кеш общих для всех пользователей частей представления рецептов.
+
+Большая часть ответа ``RecipeSerializer`` (автор, теги, ингредиенты,
+изображение, текст) одинакова для всех. Она сериализуется один раз и
+хранится в кеше ответов под ключом, в который входят id рецепта, его
+``updated``, версии справочников тегов и ингредиентов и параметры
+представления (адрес сайта, размер изображений). Изменённый рецепт
+получает новый ключ, поэтому записи не нужно удалять — старые вытесняются
+по времени жизни.
+
+Поля, зависящие от пользователя (флаги избранного, корзины и подписки),
+накладываются на копию фрагмента при каждом ответе. Теги и ингредиенты
+загружаются только для рецептов, которых нет в кеше.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Manager, prefetch_related_objects
+from rest_framework import serializers
+
+from recipes.models import Recipe
+from .cache import ingredients_catalog, tags_catalog
+
+FRAGMENT_TTL = 24 * 60 * 60
+
+
+def fragment_cache():
+    return caches[settings.RESPONSE_CACHE]
+
+
+def fragment_keys(serializer, recipes):
+    """Ключи фрагментов рецептов для представления ``serializer``."""
+    request = serializer.context.get('request')
+    prefix = '\n'.join((
+        type(serializer).__name__,
+        request.build_absolute_uri('/') if request is not None else '',
+        str(bool(serializer.context.get('original_images'))),
+        tags_catalog.version(),
+        ingredients_catalog.version(),
+    ))
+    return {
+        recipe.pk: 'fragments:recipe:' + hashlib.sha1(
+            f'{prefix}\n{recipe.pk}\n{recipe.updated.isoformat()}'.encode()
+        ).hexdigest()
+        for recipe in recipes
+    }
+
+
+def load_fragments(serializer, recipes, build):
+    """Возвращает фрагменты рецептов по id, сериализуя через ``build``
+    только отсутствующие в кеше."""
+    keys = fragment_keys(serializer, recipes)
+    cache = fragment_cache()
+    cached = cache.get_many(list(keys.values()))
+    missing = [recipe for recipe in recipes if keys[recipe.pk] not in cached]
+    if missing:
+        prefetch_related_objects(missing, *Recipe.objects.related_lookups())
+        fresh = {keys[recipe.pk]: build(recipe) for recipe in missing}
+        cache.set_many(fresh, FRAGMENT_TTL)
+        cached.update(fresh)
+    return {pk: cached[key] for pk, key in keys.items()}
+
+
+class FragmentListSerializer(serializers.ListSerializer):
+    """Список рецептов, собираемый из кешированных фрагментов"""
+
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, Manager) else data
+        return self.child.represent(list(recipes))
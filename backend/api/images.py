@@ -0,0 +1,90 @@
+"""Фоновая подготовка уменьшенных копий изображений рецептов.
+
+Копии создаются в пуле потоков процесса, без внешнего брокера. Имена
+оригиналов — хеши содержимого (см. ``recipes.storage``), поэтому копия
+одного и того же изображения создаётся один раз.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, features
+
+from recipes.models import Recipe
+from .cache import recipe_responses
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def thumbnail_name(image_name):
+    base = os.path.splitext(os.path.basename(image_name))[0]
+    return f'thumbnails/{base}.{THUMBNAIL_FORMAT.lower()}'
+
+
+def render_thumbnail(source):
+    image = Image.open(source)
+    image.thumbnail(settings.THUMBNAIL_SIZE)
+    if THUMBNAIL_FORMAT == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, THUMBNAIL_FORMAT, quality=80)
+    return buffer.getvalue()
+
+
+def make_thumbnail(recipe_id, image_name):
+    """Создаёт копию изображения и записывает её рецепту, если у рецепта
+    за это время не сменилось изображение."""
+    image_field = Recipe._meta.get_field('image')
+    thumbnail_field = Recipe._meta.get_field('thumbnail')
+    name = thumbnail_name(image_name)
+    try:
+        if not thumbnail_field.storage.exists(name):
+            with image_field.storage.open(image_name) as source:
+                content = render_thumbnail(source)
+            name = thumbnail_field.storage.save(name, ContentFile(content))
+        if Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+                thumbnail=name, updated=timezone.now()):
+            recipe_responses.invalidate([f'recipe:{recipe_id}'])
+    except Exception:
+        logger.exception('Не удалось создать копию изображения %s',
+                         image_name)
+
+
+def make_thumbnail_in_worker(recipe_id, image_name):
+    """``make_thumbnail`` в потоке пула: соединения потока закрываются,
+    чтобы они не оставались открытыми между задачами."""
+    try:
+        make_thumbnail(recipe_id, image_name)
+    finally:
+        connections.close_all()
+
+
+def schedule_thumbnail(recipe):
+    """Ставит создание копии в очередь после фиксации транзакции."""
+    if not recipe.image:
+        return
+    args = (recipe.pk, recipe.image.name)
+    if not settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: make_thumbnail(*args))
+        return
+    transaction.on_commit(lambda: get_executor().submit(
+        make_thumbnail_in_worker, *args))
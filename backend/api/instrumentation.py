@@ -0,0 +1,329 @@
+"""Замеры времени обработки запросов.
+
+``InstrumentationMiddleware`` включается настройкой ``INSTRUMENTATION``;
+если она выключена, Django исключает middleware из цепочки и замеры
+ничего не стоят. Для каждого запроса считаются:
+
+* ``total`` — время от входа в middleware до готового ответа;
+* ``db`` — время SQL-запросов (через ``connection.execute_wrapper``),
+  их число и повторы: запросы с одинаковым текстом без значений
+  параметров, обычно признак N+1;
+* ``app`` — время представления без SQL, то есть в основном работа
+  сериализаторов;
+* ``render`` — кодирование ответа DRF в JSON;
+* размер тела ответа.
+
+Времена отдаются в заголовке ``Server-Timing``, накапливаются в
+гистограммах по маршрутам (``/metrics`` в текстовом формате Prometheus)
+и попадают в журнал ``api.instrumentation``, если запрос выполнялся
+дольше ``SLOW_REQUEST_MS``: в запись входят самые долгие и повторяющиеся
+SQL-запросы. Метрики хранятся в памяти процесса, поэтому при нескольких
+воркерах каждый отдаёт свои.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from foodgram.db.base import pools
+from .authentication import token_cache
+from .cache import recipe_responses
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Самые долгие запросы и повторы, попадающие в запись журнала.
+SLOW_LOG_QUERIES = 5
+# Тексты запросов хранятся не для всех запросов страницы.
+MAX_RECORDED_QUERIES = 200
+
+current_stats = ContextVar('request_stats', default=None)
+
+PLACEHOLDERS = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    """Текст запроса без значений: списки IN и числа заменены."""
+    return LITERALS.sub('?', PLACEHOLDERS.sub('(...)', sql))
+
+
+class RequestStats:
+    """Замеры одного запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = 0
+        self.fingerprints = Counter()
+        self.recorded = []
+        self.view_started = None
+        self.view_db_time = 0.0
+        self.view_time = None
+        self.render_started = None
+
+    def record_query(self, sql, duration):
+        self.db_time += duration
+        self.queries += 1
+        self.fingerprints[fingerprint(sql)] += 1
+        if len(self.recorded) < MAX_RECORDED_QUERIES:
+            self.recorded.append((duration, sql))
+
+    @property
+    def duplicates(self):
+        return {
+            sql: count for sql, count in self.fingerprints.items()
+            if count > 1
+        }
+
+
+def record_query(execute, sql, params, many, context):
+    """Обёртка ``execute_wrapper``: время запроса в текущие замеры."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = current_stats.get()
+        if stats is not None:
+            stats.record_query(sql, time.perf_counter() - started)
+
+
+@contextmanager
+def record_queries():
+    """Подключает ``record_query`` к соединениям текущего потока, если
+    запрос замеряется."""
+    if current_stats.get() is None:
+        yield
+        return
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(record_query))
+        yield
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками"""
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = defaultdict(lambda: [[0] * len(buckets), 0.0, 0])
+
+    def observe(self, labels, value):
+        counts, _, _ = series = self.series[labels]
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[position] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            prefix = format_labels(labels)
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(
+                    f'{self.name}_bucket{{{prefix},le="{bound}"}} {bucket}')
+            lines.append(f'{self.name}_bucket{{{prefix},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{prefix}}} {total}')
+            lines.append(f'{self.name}_count{{{prefix}}} {count}')
+        return lines
+
+
+def format_labels(labels):
+    return ','.join(
+        f'{name}="{escape_label(value)}"' for name, value in labels)
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')
+
+
+def render_counter(name, help_text, values):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+    for labels, value in sorted(values.items()):
+        lines.append(f'{name}{{{format_labels(labels)}}} {value}')
+    return lines
+
+
+class Metrics:
+    """Метрики запросов процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.duration = Histogram(
+                'foodgram_request_duration_seconds',
+                'Время обработки запроса.')
+            self.db_duration = Histogram(
+                'foodgram_request_db_seconds',
+                'Время SQL-запросов при обработке запроса.')
+            self.queries = Histogram(
+                'foodgram_request_queries', 'SQL-запросов на запрос.',
+                buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+            self.duplicates = Counter()
+            self.response_bytes = Counter()
+            self.responses = Counter()
+
+    def observe(self, route, method, status, stats, total, size):
+        labels = (('route', route), ('method', method))
+        with self.lock:
+            self.duration.observe(labels, total)
+            self.db_duration.observe(labels, stats.db_time)
+            self.queries.observe(labels, stats.queries)
+            self.duplicates[labels] += sum(stats.duplicates.values())
+            self.response_bytes[labels] += size
+            self.responses[labels + (('status', str(status)),)] += 1
+
+    def render(self):
+        with self.lock:
+            lines = [
+                *self.duration.render(),
+                *self.db_duration.render(),
+                *self.queries.render(),
+                *render_counter(
+                    'foodgram_request_duplicate_queries_total',
+                    'Повторы SQL-запросов с одинаковым текстом.',
+                    self.duplicates),
+                *render_counter(
+                    'foodgram_response_bytes_total',
+                    'Размер тел ответов.', self.response_bytes),
+                *render_counter(
+                    'foodgram_responses_total',
+                    'Ответы по кодам статуса.', self.responses),
+            ]
+        lines += render_counter(
+            'foodgram_cache_requests_total',
+            'Обращения к кешам ответов и токенов.', {
+                **{(('cache', 'responses'), ('result', name)):
+                   recipe_responses.stats[name]
+                   for name in ('hit', 'miss', 'stale')},
+                **{(('cache', 'tokens'), ('result', name)):
+                   token_cache.stats[name]
+                   for name in ('hit', 'shared', 'miss')},
+            })
+        lines += render_counter(
+            'foodgram_db_pool_connections_total',
+            'Соединения пула: открытые, выданные повторно, закрытые после '
+            'ошибки и не дождавшиеся свободного места.', {
+                (('alias', alias), ('event', name)): pool.stats[name]
+                for (pid, alias), pool in list(pools.items())
+                if pid == os.getpid()
+                for name in ('created', 'reused', 'discarded', 'timeout')
+            })
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus."""
+    if not settings.INSTRUMENTATION:
+        raise Http404
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length', 0))
+    return len(response.content)
+
+
+class InstrumentationMiddleware:
+    """Замеры запроса: ``Server-Timing``, метрики и журнал медленных"""
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            with record_queries():
+                response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        total = time.perf_counter() - stats.started
+        self.report(request, response, stats, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current_stats.get()
+        if stats is not None:
+            stats.view_started = time.perf_counter()
+            stats.view_db_time = stats.db_time
+
+    def process_template_response(self, request, response):
+        # Вызывается после представления, но до кодирования ответа DRF.
+        stats = current_stats.get()
+        if stats is not None and stats.view_started is not None:
+            stats.view_time = (
+                time.perf_counter() - stats.view_started
+                - (stats.db_time - stats.view_db_time))
+            stats.render_started = time.perf_counter()
+        return response
+
+    def report(self, request, response, stats, total):
+        timings = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={stats.db_time * 1000:.1f};'
+            f'desc="queries={stats.queries} '
+            f'duplicates={sum(stats.duplicates.values())}"',
+        ]
+        if stats.view_time is not None:
+            render_time = time.perf_counter() - stats.render_started
+            timings += [f'app;dur={stats.view_time * 1000:.1f}',
+                        f'render;dur={render_time * 1000:.1f}']
+        response['Server-Timing'] = ', '.join(timings)
+        size = response_size(response)
+        route = route_name(request)
+        metrics.observe(route, request.method, response.status_code, stats,
+                        total, size)
+        if total * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.get_full_path(),
+                'route': route,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 1),
+                'db_ms': round(stats.db_time * 1000, 1),
+                'queries': stats.queries,
+                'bytes': size,
+                'slowest': [
+                    {'ms': round(duration * 1000, 1), 'sql': sql}
+                    for duration, sql in sorted(
+                        stats.recorded, reverse=True)[:SLOW_LOG_QUERIES]
+                ],
+                'duplicates': [
+                    {'count': count, 'sql': sql}
+                    for sql, count in Counter(
+                        stats.duplicates).most_common(SLOW_LOG_QUERIES)
+                ],
+            }, ensure_ascii=False))
@@ -0,0 +1,124 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_databases,
+                               teardown_databases)
+from django.utils import timezone
+
+from api import benchmark
+from api.authentication import token_cache
+from api.cache import recipe_responses
+
+
+class Command(BaseCommand):
+    help = ('Наполняет временную базу синтетическими данными и замеряет '
+            'количество запросов, время и размер ответов эндпоинтов API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--ingredients', type=int, default=300)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags', type=int, default=5)
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Избранных рецептов на пользователя.')
+        parser.add_argument('--carts', type=int, default=15,
+                            help='Рецептов в корзине на пользователя.')
+        parser.add_argument('--subscriptions', type=int, default=20,
+                            help='Подписок на пользователя.')
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', nargs='*', default=None,
+                            choices=sorted(benchmark.SCENARIOS),
+                            help='Запустить только указанные сценарии.')
+        parser.add_argument('--output', help='Файл для результатов в JSON.')
+        parser.add_argument('--compare',
+                            help='JSON предыдущего прогона для сравнения.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый относительный рост p50.')
+        parser.add_argument('--query-threshold', type=float, default=0.0,
+                            help='Допустимый относительный рост числа '
+                                 'запросов.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Не удалять тестовую базу после прогона.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+
+        media_root = tempfile.mkdtemp(prefix='foodgram-benchmark-')
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                ctx = benchmark.seed(
+                    users=options['users'],
+                    recipes=options['recipes'],
+                    ingredients=options['ingredients'],
+                    ingredients_per_recipe=options['ingredients_per_recipe'],
+                    tags=options['tags'],
+                    favorites=options['favorites'],
+                    carts=options['carts'],
+                    subscriptions=options['subscriptions'],
+                    page_size=options['page_size'],
+                )
+                results = benchmark.run(ctx, repeat=options['repeat'],
+                                        warmup=options['warmup'],
+                                        names=options['only'])
+        finally:
+            teardown_databases(old_config, verbosity=0,
+                               keepdb=options['keepdb'])
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<28} {result["status"]:>3} '
+                f'{result["queries"]:>4} запр. '
+                f'p50 {result["p50_ms"]:>9} мс '
+                f'p99 {result["p99_ms"]:>9} мс '
+                f'{result["bytes"]:>8} байт'
+            )
+        stats = recipe_responses.stats
+        if stats['hit'] or stats['miss']:
+            self.stdout.write(
+                f'Кеш ответов: попаданий {stats["hit"]}, промахов '
+                f'{stats["miss"]} (из них устаревших {stats["stale"]}), '
+                f'доля попаданий {recipe_responses.hit_rate():.0%}.')
+        stats = token_cache.stats
+        if stats['hit'] or stats['shared'] or stats['miss']:
+            self.stdout.write(
+                f'Кеш токенов: из памяти {stats["hit"]}, из общего кеша '
+                f'{stats["shared"]}, промахов {stats["miss"]}, доля '
+                f'попаданий {token_cache.hit_rate():.0%}.')
+
+        if options['output']:
+            report = {
+                'meta': {
+                    'created': timezone.now().isoformat(),
+                    'vendor': connection.vendor,
+                    'options': {
+                        key: options[key] for key in (
+                            'users', 'recipes', 'ingredients',
+                            'ingredients_per_recipe', 'tags', 'favorites',
+                            'carts', 'subscriptions', 'page_size', 'repeat')
+                    },
+                },
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+        if baseline is not None:
+            regressions = benchmark.compare(
+                baseline, results, threshold=options['threshold'],
+                query_threshold=options['query_threshold'])
+            if regressions:
+                raise CommandError(
+                    'Обнаружены регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий не обнаружено.'))
@@ -0,0 +1,183 @@
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test.utils import (override_settings, setup_databases,
+                               teardown_databases)
+from rest_framework.authtoken.models import Token
+
+from api import benchmark
+
+MODES = ('wsgi', 'asgi')
+
+
+def split_path(path):
+    parts = urlsplit(path)
+    return parts.path, parts.query
+
+
+def wsgi_request(handler, path, token):
+    path, query = split_path(path)
+    response = handler({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'testserver',
+        'HTTP_AUTHORIZATION': f'Token {token}',
+        'wsgi.input': BytesIO(),
+        'wsgi.url_scheme': 'http',
+    }, lambda status, headers: None)
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return response.status_code
+
+
+async def asgi_request(handler, path, token, delay):
+    path, query = split_path(path)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'query_string': query.encode(),
+        'headers': [(b'host', b'testserver'),
+                    (b'authorization', f'Token {token}'.encode())],
+        'server': ('testserver', 80),
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif not message.get('more_body'):
+            # Медленный клиент: ответ уходит в сеть delay секунд.
+            await asyncio.sleep(delay)
+
+    await handler(scope, receive, send)
+    return status
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность синхронного (WSGI) и '
+            'асинхронного (ASGI) режимов при множестве одновременных '
+            'соединений медленных клиентов. Серверы не запускаются: '
+            'запросы передаются обработчикам Django в процессе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500,
+                            help='Одновременных соединений.')
+        parser.add_argument('--requests', type=int, default=4,
+                            help='Запросов на соединение.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Синхронных воркеров в режиме WSGI.')
+        parser.add_argument('--client-delay', type=float, default=0.05,
+                            help='Секунд, за которые клиент получает '
+                                 'ответ.')
+        parser.add_argument('--modes', nargs='*', choices=MODES,
+                            default=list(MODES))
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--users', type=int, default=50)
+
+    def paths(self, ctx):
+        return [
+            f'/api/recipes/?limit={ctx.page_size}',
+            f'/api/recipes/{ctx.recipes[0]}/',
+            '/api/ingredients/autocomplete/?'
+            + urlencode({'name': 'Ингредиент 1'}),
+            '/api/recipes/download_shopping_cart/',
+        ]
+
+    def run_wsgi(self, paths, token, options):
+        """Синхронные воркеры: воркер занят, пока клиент не получит
+        ответ целиком."""
+        handler = WSGIHandler()
+        workers = threading.BoundedSemaphore(options['workers'])
+        results = []
+
+        def client(number):
+            for index in range(options['requests']):
+                path = paths[(number + index) % len(paths)]
+                started = time.perf_counter()
+                with workers:
+                    status = wsgi_request(handler, path, token)
+                    time.sleep(options['client_delay'])
+                results.append((status, time.perf_counter() - started))
+
+        clients = [threading.Thread(target=client, args=(number,))
+                   for number in range(options['connections'])]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return results
+
+    def run_asgi(self, paths, token, options):
+        handler = ASGIHandler()
+        results = []
+
+        async def client(number):
+            for index in range(options['requests']):
+                path = paths[(number + index) % len(paths)]
+                started = time.perf_counter()
+                try:
+                    status = await asgi_request(handler, path, token,
+                                                options['client_delay'])
+                except Exception:
+                    # Соединение, оборванное сервером из-за ошибки.
+                    status = 500
+                results.append((status, time.perf_counter() - started))
+
+        async def main():
+            await asyncio.gather(*(
+                client(number) for number in range(options['connections'])))
+
+        asyncio.run(main())
+        return results
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp(prefix='foodgram-benchmark-')
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     keepdb=False)
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                ctx = benchmark.seed(users=options['users'],
+                                     recipes=options['recipes'])
+                token = Token.objects.get(user=ctx.user).key
+                paths = self.paths(ctx)
+                for mode in options['modes']:
+                    run = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+                    started = time.perf_counter()
+                    results = run(paths, token, options)
+                    elapsed = time.perf_counter() - started
+                    self.report(mode, results, elapsed)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def report(self, mode, results, elapsed):
+        timings = [duration * 1000 for _, duration in results]
+        errors = sum(1 for status, _ in results if status >= 400)
+        self.stdout.write(
+            f'{mode:<10} {len(results):>6} запр. '
+            f'{len(results) / elapsed:>8.1f} запр./с '
+            f'p50 {benchmark.percentile(timings, 50):>9.1f} мс '
+            f'p99 {benchmark.percentile(timings, 99):>9.1f} мс '
+            f'ошибок {errors}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from api.images import make_thumbnail
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создаёт уменьшенные копии изображений для рецептов, '
+            'у которых их ещё нет.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.filter(
+            Q(thumbnail__isnull=True) | Q(thumbnail='')
+        ).exclude(
+            Q(image__isnull=True) | Q(image='')
+        ).values_list('pk', 'image')
+        total = 0
+        for recipe_id, image_name in recipes.iterator():
+            make_thumbnail(recipe_id, image_name)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано рецептов: {total}.'))
@@ -0,0 +1,193 @@
+"""Подбор рецептов по ингредиентам, которые есть у пользователя.
+
+Индекс хранится в памяти процесса: для каждого ингредиента — отсортированный
+массив id рецептов, в которые он входит, для каждого рецепта — кортеж его
+ингредиентов. Оценка сводится к подсчёту совпадений по спискам рецептов
+для ингредиентов пользователя, поэтому не зависит от общего числа рецептов.
+
+Изменённые рецепты записываются в журнал в общем кеше Django
+(``matching:changes:<поколение>:<номер>``), последний номер хранится вместе
+с поколением журнала в ``matching:head``. При обращении каждый процесс
+дочитывает журнал и обновляет только изменённые рецепты, а если часть
+журнала уже вытеснена из кеша — перестраивает индекс целиком. Если вытеснена
+сама голова, журнал начинается заново с новым поколением, и все процессы
+перестраивают индекс.
+"""
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from heapq import nsmallest
+from itertools import groupby
+from operator import itemgetter
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from foodgram.db.transaction import OnCommitBatch
+from recipes.models import RecipeIngredient
+
+HEAD_KEY = 'matching:head'
+CHANGE_KEY = 'matching:changes:{}:{}'
+JOURNAL_TTL = 24 * 60 * 60
+JOURNAL_BATCH = 32
+
+
+def ingredient_rows(recipe_ids=None):
+    rows = RecipeIngredient.objects.order_by('recipe_id')
+    if recipe_ids is not None:
+        rows = rows.filter(recipe_id__in=list(recipe_ids))
+    return groupby(
+        rows.values_list('recipe_id', 'ingredient_id').iterator(),
+        itemgetter(0),
+    )
+
+
+class RankedRecipes:
+    """Найденные рецепты, упорядоченные по доле имеющихся ингредиентов и
+    числу недостающих.
+
+    Поддерживает ``len`` и срезы, поэтому подходит для пагинатора;
+    сортируются только рецепты до конца запрошенной страницы.
+    """
+
+    def __init__(self, matcher, matched, max_missing=None):
+        self.items = []
+        for recipe_id, count in matched.items():
+            missing = len(matcher.recipes[recipe_id]) - count
+            if max_missing is None or missing <= max_missing:
+                self.items.append(
+                    (-count / (count + missing), missing, -recipe_id))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(len(self.items))
+        return [
+            (-negative_id, -negative_coverage, missing)
+            for negative_coverage, missing, negative_id
+            in nsmallest(stop, self.items)[start:stop]
+        ]
+
+
+class IngredientMatcher:
+    """Индекс «ингредиент -> рецепты» для подбора рецептов"""
+
+    def __init__(self, generation=None, version=0):
+        self.generation = generation
+        self.version = version
+        self.recipes = {}
+        self.postings = {}
+
+    @classmethod
+    def from_db(cls, generation=None, version=0):
+        matcher = cls(generation, version)
+        postings = defaultdict(list)
+        for recipe_id, rows in ingredient_rows():
+            ingredients = tuple(ingredient_id for _, ingredient_id in rows)
+            matcher.recipes[recipe_id] = ingredients
+            for ingredient_id in ingredients:
+                postings[ingredient_id].append(recipe_id)
+        # Строки идут по возрастанию id рецепта, массивы уже отсортированы.
+        matcher.postings = {
+            ingredient_id: array('q', recipe_ids)
+            for ingredient_id, recipe_ids in postings.items()
+        }
+        return matcher
+
+    def update(self, recipe_ids):
+        """Перечитывает из базы состав указанных рецептов."""
+        fresh = {
+            recipe_id: tuple(ingredient_id for _, ingredient_id in rows)
+            for recipe_id, rows in ingredient_rows(recipe_ids)
+        }
+        for recipe_id in recipe_ids:
+            for ingredient_id in self.recipes.pop(recipe_id, ()):
+                postings = self.postings[ingredient_id]
+                del postings[bisect_left(postings, recipe_id)]
+            ingredients = fresh.get(recipe_id)
+            if not ingredients:
+                continue
+            self.recipes[recipe_id] = ingredients
+            for ingredient_id in ingredients:
+                insort(self.postings.setdefault(ingredient_id, array('q')),
+                       recipe_id)
+
+    def sync(self):
+        """Применяет изменения из журнала. Возвращает False, если журнал
+        неполон или начат заново и индекс нужно перестроить."""
+        generation, head = journal_head()
+        if generation != self.generation:
+            return False
+        version = self.version
+        changed = set()
+        while True:
+            keys = [CHANGE_KEY.format(generation, number) for number in
+                    range(version + 1, version + 1 + JOURNAL_BATCH)]
+            entries = cache.get_many(keys)
+            for key in keys:
+                if key not in entries:
+                    break
+                changed.update(entries[key])
+                version += 1
+            else:
+                continue
+            break
+        if head > version:
+            return False
+        if changed:
+            self.update(changed)
+        self.version = version
+        return True
+
+    def match(self, ingredient_ids, max_missing=None):
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(self.postings.get(ingredient_id, ()))
+        return RankedRecipes(self, matched, max_missing)
+
+
+def journal_head():
+    """Возвращает поколение журнала и номер последней записи. Если голова
+    вытеснена из кеша, начинает новое поколение."""
+    head = cache.get(HEAD_KEY)
+    if head is None:
+        head = (uuid4().hex, 0)
+        if not cache.add(HEAD_KEY, head, None):
+            head = cache.get(HEAD_KEY, head)
+    return tuple(head)
+
+
+_matcher = None
+
+
+def get_matcher():
+    global _matcher
+    if _matcher is None or not _matcher.sync():
+        _matcher = IngredientMatcher.from_db(*journal_head())
+    return _matcher
+
+
+def publish_changes(recipe_ids):
+    """Добавляет запись об изменённых рецептах в журнал."""
+    generation, number = journal_head()
+    number += 1
+    while not cache.add(CHANGE_KEY.format(generation, number),
+                        list(recipe_ids), JOURNAL_TTL):
+        number += 1
+    cache.set(HEAD_KEY, (generation, number), None)
+
+
+class PendingChanges(OnCommitBatch):
+    """Рецепты, изменённые в текущей транзакции"""
+
+    def process(self, recipe_ids):
+        publish_changes(recipe_ids)
+
+
+def schedule_publish(recipe_id, using='default'):
+    """Публикует изменение рецепта после фиксации транзакции, одной записью
+    на транзакцию."""
+    PendingChanges.add([recipe_id], using)
@@ -1,6 +1,46 @@
+from django.db.models import BooleanField, Prefetch, Value
 from rest_framework import mixins, viewsets
 
+from recipes.models import Recipe
+from users.models import User
+from .relations import CONTEXT_KEY, ViewerRelations
+from .serializers import RecipesLimitSerializer
+
 
 class CreateListViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
                         viewsets.GenericViewSet):
     pass
+
+
+class ViewerRelationsMixin:
+    """Один объект связей текущего пользователя на все сериализаторы
+    запроса (см. ``api.relations``)."""
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context[CONTEXT_KEY] = ViewerRelations(self.request.user)
+        return context
+
+
+class SubscriptionsMixin:
+    """Выборка авторов, на которых подписан текущий пользователь.
+
+    Последние рецепты всех авторов страницы загружаются одним запросом,
+    флаг подписки и количество рецептов не требуют запросов вовсе.
+    """
+
+    def get_recipes_limit(self):
+        serializer = RecipesLimitSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data.get('recipes_limit')
+
+    def get_subscriptions(self, recipes_limit=None):
+        return User.objects.filter(
+            subscription__user=self.request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).prefetch_related(Prefetch(
+            'recipes',
+            queryset=Recipe.objects.limit_per_author(recipes_limit),
+            to_attr='limited_recipes',
+        ))
@@ -1,6 +1,153 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка количества строк по плану запроса PostgreSQL.
+
+    На остальных базах возвращает точное значение.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPaginator(CursorPagination):
+    """Курсорная (keyset) пагинация без OFFSET.
+
+    Порядок берётся из queryset (по умолчанию ``Meta.ordering`` модели),
+    а если у вьюсета есть ``OrderingFilter`` — из него. Общее количество
+    по умолчанию не считается; ``?count=exact`` и ``?count=approximate``
+    возвращают точное значение или оценку планировщика.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        self.ordering = tuple(
+            queryset.query.order_by or queryset.model._meta.ordering
+        ) or self.ordering
+        return super().get_ordering(request, queryset, view)
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'approximate':
+            return estimate_count(queryset)
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
 
 
 class LimitPageNumberPaginator(PageNumberPagination):
+    """Постраничная пагинация с параметром limit.
+
+    Запрос с параметром ``cursor`` или ``pagination=cursor`` переключает
+    пагинатор на ``KeysetPaginator`` с тем же форматом ответа (кроме
+    постраничного вывода списков, которые не являются queryset, и
+    результатов поиска, упорядоченных по релевантности: курсор строится по
+    полям сортировки, а релевантность вычисляется в запросе).
+    """
     page_size = 6
     page_size_query_param = 'limit'
+    keyset_paginator_class = KeysetPaginator
+
+    def use_keyset(self, request, queryset):
+        if not isinstance(queryset, QuerySet) or any(
+            isinstance(field, str) and field.lstrip('-') == 'search_rank'
+            for field in queryset.query.order_by
+        ):
+            return False
+        return (
+            self.keyset_paginator_class.cursor_query_param
+            in request.query_params
+            or request.query_params.get('pagination') == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request, queryset):
+            self.keyset = self.keyset_paginator_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.keyset is not None:
+            return self.keyset.to_html()
+        return super().to_html()
+
+
+class FeedPaginator(BasePagination):
+    """Пагинация ленты по ключу: ``?before=<id>`` возвращает рецепты
+    старше указанного, ссылка ``next`` ведёт на следующую страницу.
+
+    Записи ленты загружает функция ``load(limit, before)``, возвращающая
+    id рецептов по убыванию.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    before_query_param = 'before'
+
+    def get_number(self, request, name, default=None):
+        value = request.query_params.get(name)
+        if not value:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            raise NotFound(f'Неверное значение параметра {name}.')
+        if number < 1:
+            raise NotFound(f'Неверное значение параметра {name}.')
+        return number
+
+    def paginate_ids(self, load, request):
+        self.request = request
+        limit = min(self.get_number(request, self.page_size_query_param,
+                                    self.page_size), self.max_page_size)
+        ids = load(limit + 1, self.get_number(request,
+                                              self.before_query_param))
+        self.ids = ids[:limit]
+        self.has_next = len(ids) > limit
+        return self.ids
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.before_query_param, self.ids[-1])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
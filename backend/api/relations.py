@@ -0,0 +1,84 @@
+"""Связи текущего пользователя с авторами и рецептами ответа.
+
+Объект ``ViewerRelations`` создаётся один раз на запрос и передаётся
+сериализаторам через контекст. Подписки, избранное и корзина загружаются
+не более чем тремя запросами — только для id объектов, которые
+сериализуются в этом ответе.
+"""
+from recipes.models import Cart, Favorite, Recipe
+from users.models import Subscription, User
+
+CONTEXT_KEY = 'viewer_relations'
+
+# Вид связи: (модель, поле с id объекта).
+RELATIONS = {
+    'subscriptions': (Subscription, 'author_id'),
+    'favorites': (Favorite, 'recipe_id'),
+    'cart': (Cart, 'recipe_id'),
+}
+
+
+class ViewerRelations:
+    """Подписки, избранное и корзина пользователя для объектов ответа"""
+
+    def __init__(self, user):
+        self.user = user
+        self._pending = {kind: set() for kind in RELATIONS}
+        self._loaded = {kind: set() for kind in RELATIONS}
+        self._related = {kind: set() for kind in RELATIONS}
+        self._tracked = set()
+
+    def track(self, instance):
+        """Запоминает id объектов (одного или страницы), о которых
+        сериализаторы будут спрашивать."""
+        if instance is None or id(instance) in self._tracked:
+            return
+        self._tracked.add(id(instance))
+        objects = (
+            (instance,) if isinstance(instance, (User, Recipe)) else instance
+        )
+        for obj in objects:
+            if isinstance(obj, User):
+                self._pending['subscriptions'].add(obj.pk)
+            elif isinstance(obj, Recipe):
+                self._pending['subscriptions'].add(obj.author_id)
+                self._pending['favorites'].add(obj.pk)
+                self._pending['cart'].add(obj.pk)
+
+    def _has(self, kind, pk):
+        if self.user is None or self.user.is_anonymous:
+            return False
+        if pk not in self._loaded[kind]:
+            model, field = RELATIONS[kind]
+            ids = self._pending[kind] - self._loaded[kind]
+            ids.add(pk)
+            self._related[kind].update(model.objects.filter(
+                user=self.user, **{f'{field}__in': ids}
+            ).values_list(field, flat=True))
+            self._loaded[kind].update(ids)
+            self._pending[kind].clear()
+        return pk in self._related[kind]
+
+    def is_subscribed(self, author):
+        if self.user is not None and author.pk == self.user.pk:
+            return False
+        return self._has('subscriptions', author.pk)
+
+    def is_favorited(self, recipe):
+        return self._has('favorites', recipe.pk)
+
+    def is_in_shopping_cart(self, recipe):
+        return self._has('cart', recipe.pk)
+
+
+def get_viewer_relations(serializer):
+    """Возвращает общий для всего дерева сериализаторов объект связей,
+    создавая его при первом обращении."""
+    context = serializer.context
+    relations = context.get(CONTEXT_KEY)
+    if relations is None:
+        request = context.get('request')
+        relations = ViewerRelations(request.user if request else None)
+        context[CONTEXT_KEY] = relations
+    relations.track(serializer.root.instance)
+    return relations
@@ -1,14 +1,20 @@
 from django.contrib.auth.password_validation import validate_password
 from django.core import exceptions as django_exceptions
 from django.db import IntegrityError, transaction
+from django.db.models.signals import m2m_changed
 from rest_framework import serializers
-from rest_framework.serializers import PrimaryKeyRelatedField
 from rest_framework.settings import api_settings
 
-from api.fields import Base64ImageField
-from users.models import Subscription, User
+from api.fields import (Base64ImageField, BulkPrimaryKeyRelatedField,
+                        ThumbnailImageField)
+from api.fragments import FragmentListSerializer, load_fragments
+from api.images import schedule_thumbnail
+from api.relations import get_viewer_relations
 from recipes.models import (Cart, Favorite, Ingredient, Recipe,
-                            RecipeIngredient, Tag)
+                            RecipeIngredient, ShoppingListItem, Tag)
+from recipes.search import schedule_indexing
+from recipes.signals import recipe_rewrite
+from users.models import Subscription, User
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -27,12 +33,10 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        if (self.context.get('request')
-           and not self.context['request'].user.is_anonymous):
-            return Subscription.objects.filter(user=self.context['request'].
-                                               user,
-                                               author=obj).exists()
-        return False
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
+        return get_viewer_relations(self).is_subscribed(obj)
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -78,12 +82,7 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return attrs
 
     def get_is_subscribed(self, obj):
-        if (self.context.get('request')
-           and not self.context['request'].user.is_anonymous):
-            return Subscription.objects.filter(user=self.context['request'].
-                                               user,
-                                               author=obj).exists()
-        return False
+        return get_viewer_relations(self).is_subscribed(obj)
 
     def perform_create(self, validated_data):
         with transaction.atomic():
@@ -131,12 +130,26 @@ class IngredientIdSerializer(serializers.Serializer):
         return value
 
 
+class RecipesLimitSerializer(serializers.Serializer):
+    """Проверка параметра recipes_limit в списке подписок"""
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    """Проверка параметров подбора рецептов по ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=200,
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериалайзер для модели Recipe (GET)"""
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(many=True)
     tags = TagSerializer(many=True, read_only=True)
-    image = Base64ImageField()
+    image = ThumbnailImageField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -154,23 +167,74 @@ class RecipeSerializer(serializers.ModelSerializer):
             'text',
             'cooking_time',
         )
+        list_serializer_class = FragmentListSerializer
+
+    # Поля, которые зависят от запроса и не хранятся во фрагменте.
+    viewer_fields = ('is_favorited', 'is_in_shopping_cart')
+
+    def to_representation(self, instance):
+        return self.represent([instance])[0]
+
+    def build_fragment(self, instance):
+        fragment = super().to_representation(instance)
+        for name in self.viewer_fields:
+            fragment[name] = None
+        fragment['author']['is_subscribed'] = None
+        return fragment
+
+    def represent(self, recipes):
+        """Представления рецептов: общий фрагмент из кеша и поля текущего
+        пользователя поверх него."""
+        for recipe in recipes:
+            # Флаг подписки, аннотированный в
+            # RecipeQuerySet.with_user_flags, передаём автору, чтобы
+            # UserSerializer не делал лишний запрос.
+            is_author_subscribed = getattr(
+                recipe, 'is_author_subscribed', None)
+            if is_author_subscribed is not None:
+                recipe.author.is_subscribed = is_author_subscribed
+        fragments = load_fragments(self, recipes, self.build_fragment)
+        author_field = self.fields['author']
+        results = []
+        for recipe in recipes:
+            data = fragments[recipe.pk].copy()
+            for name in self.viewer_fields:
+                field = self.fields[name]
+                data[name] = field.to_representation(
+                    field.get_attribute(recipe))
+            data['author'] = data['author'].copy()
+            data['author']['is_subscribed'] = author_field.get_is_subscribed(
+                recipe.author)
+            results.append(data)
+        return results
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Favorite.objects.filter(user=user, recipe=obj).exists()
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
+        return get_viewer_relations(self).is_favorited(obj)
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Cart.objects.filter(recipe=obj, user=request.user).exists()
-        return False
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
+        return get_viewer_relations(self).is_in_shopping_cart(obj)
+
+
+class CookableRecipeSerializer(RecipeSerializer):
+    """Рецепт с долей имеющихся ингредиентов и числом недостающих"""
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage', 'missing')
+
+    viewer_fields = RecipeSerializer.viewer_fields + ('coverage', 'missing')
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Сокращённый сериалайзер для модели Recipe"""
-    image = Base64ImageField()
+    image = ThumbnailImageField()
 
     class Meta:
         model = Recipe
@@ -185,7 +249,7 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
 class RecipeWriteSerializer(serializers.ModelSerializer):
     """Сериалайзер для модели Recipe (POST, UPDATE, DELETE)"""
     ingredients = IngredientIdSerializer(many=True)
-    tags = PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
     image = Base64ImageField(required=True)
     author = UserSerializer(read_only=True)
 
@@ -204,36 +268,106 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         ingredients = data.get('ingredients')
-        if len(ingredients) != len(set([item['id'] for item in ingredients])):
+        if ingredients is None:
+            return data
+        ids = [item['id'] for item in ingredients]
+        if len(ids) != len(set(ids)):
             raise serializers.ValidationError(
                 'Вы добавили несколько одинаковых ингредиентов. Ингредиенты '
                 'должны быть уникальными.')
+        missing = set(ids) - Ingredient.objects.in_bulk(ids).keys()
+        if missing:
+            raise serializers.ValidationError({
+                'ingredients': 'Ингредиенты не найдены: '
+                               + ', '.join(map(str, sorted(missing)))
+            })
         return data
 
-    def add_ingredient(self, recipe, ingredients):
+    @staticmethod
+    def save_ingredients(recipe, ingredients, current=()):
+        """Приводит состав рецепта к ``ingredients``, меняя только
+        отличающиеся строки. ``current`` — текущие строки рецепта."""
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        changed, removed = [], []
+        for item in current:
+            amount = amounts.pop(item.ingredient_id, None)
+            if amount is None:
+                removed.append(item.pk)
+            elif amount != item.amount:
+                item.amount = amount
+                changed.append(item)
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
         RecipeIngredient.objects.bulk_create(
-            [RecipeIngredient(
-                recipe=recipe,
-                ingredient_id=ingredient.get('id'),
-                amount=ingredient.get('amount')
-            ) for ingredient in ingredients]
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
         )
 
+    @staticmethod
+    def save_tags(recipe, tags, current=()):
+        """Приводит теги рецепта к ``tags``, не трогая совпадающие."""
+        through = Recipe.tags.through
+        new, current = {tag.pk for tag in tags}, set(current)
+        removed, added = current - new, new - current
+        if removed:
+            through.objects.filter(recipe=recipe, tag_id__in=removed).delete()
+        through.objects.bulk_create(
+            through(recipe=recipe, tag_id=tag_id) for tag_id in added)
+        # Запись в промежуточную таблицу напрямую не отправляет
+        # m2m_changed, поэтому сообщаем об изменении так же, как
+        # tags.add() и tags.remove().
+        for action, pk_set in (('post_remove', removed), ('post_add', added)):
+            if pk_set:
+                m2m_changed.send(
+                    sender=through, instance=recipe, action=action,
+                    reverse=False, model=Tag, pk_set=pk_set,
+                    using=recipe._state.db)
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.add(*tags)
-        self.add_ingredient(recipe, ingredients)
+        self.save_tags(recipe, tags)
+        self.save_ingredients(recipe, ingredients)
+        schedule_indexing(recipe.pk)
+        schedule_thumbnail(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        instance.tags.add(*tags)
-        self.add_ingredient(instance, ingredients)
-        return super().update(instance, validated_data)
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        # Данные уже проверены (в том числе декодировано изображение),
+        # поэтому строка рецепта заблокирована только на время записи.
+        # Текущий состав читается после блокировки: предзагруженный во
+        # вьюсете мог устареть из-за параллельного изменения.
+        list(Recipe.objects.select_for_update().filter(
+            pk=instance.pk).order_by().values_list('pk'))
+        if tags is not None:
+            self.save_tags(instance, tags, Recipe.tags.through.objects.filter(
+                recipe=instance).values_list('tag_id', flat=True))
+        if ingredients is not None:
+            current = list(RecipeIngredient.objects.filter(recipe=instance))
+            old_amounts = {
+                item.ingredient_id: item.amount for item in current}
+            new_amounts = {item['id']: item['amount'] for item in ingredients}
+            # Списки покупок меняются одним изменением на весь состав, а не
+            # сигналом на каждую удалённую строку.
+            with recipe_rewrite(instance.pk):
+                self.save_ingredients(instance, ingredients, current)
+            ShoppingListItem.objects.change_recipe(
+                instance.pk, old_amounts, new_amounts)
+        if tags is not None or ingredients is not None:
+            schedule_indexing(instance.pk)
+        if 'image' in validated_data:
+            instance.thumbnail = None
+        instance = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            schedule_thumbnail(instance)
+        return instance
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
@@ -277,28 +411,26 @@ class SubscribeSerializer(serializers.ModelSerializer):
         )
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            return ShortRecipeSerializer(
-                Recipe.objects.filter(author=obj)[:int(recipes_limit)],
-                many=True,
-                context={'request': request}
-            ).data
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.filter(author=obj)
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         return ShortRecipeSerializer(
-                Recipe.objects.filter(author=obj),
-                many=True,
-                context={'request': request}
-            ).data
+            recipes,
+            many=True,
+            context={'request': self.context.get('request')}
+        ).data
 
     def get_is_subscribed(self, obj):
-        return (self.context.get('request').user.is_authenticated
-                and Subscription.objects.filter(user=self.context['request'].
-                                                user,
-                                                author=obj).exists())
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
+        return get_viewer_relations(self).is_subscribed(obj)
 
 
 class SubscribeWriteSerializer(serializers.ModelSerializer):
@@ -331,13 +463,10 @@ class SubscribeWriteSerializer(serializers.ModelSerializer):
         return obj
 
     def get_is_subscribed(self, obj):
-        return (
-            self.context.get('request').user.is_authenticated
-            and Subscription.objects.filter(user=self.context['request'].user,
-                                            author=obj).exists())
+        return get_viewer_relations(self).is_subscribed(obj)
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class CartSerializer(serializers.ModelSerializer):
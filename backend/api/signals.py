@@ -0,0 +1,135 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.signals import catalog_changed, is_rewritten, recipes_imported
+from users.models import User
+from .authentication import token_cache
+from .cache import ingredients_catalog, schedule_invalidation, tags_catalog
+from .matching import publish_changes, schedule_publish
+
+CATALOGS = {
+    Ingredient: ingredients_catalog,
+    Tag: tags_catalog,
+}
+
+
+@receiver((post_save, post_delete, catalog_changed), sender=Ingredient)
+@receiver((post_save, post_delete, catalog_changed), sender=Tag)
+def invalidate_catalog(sender, using='default', **kwargs):
+    # Версия меняется после фиксации: иначе другой процесс успел бы
+    # собрать справочник из старых строк под новой версией.
+    transaction.on_commit(CATALOGS[sender].invalidate, using)
+    schedule_invalidation([f'catalog:{CATALOGS[sender].name}'], using)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, using, **kwargs):
+    schedule_publish(instance.pk, using)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(instance, using, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    schedule_publish(instance.recipe_id, using)
+
+
+@receiver(recipes_imported, sender=Recipe)
+def recipes_imported_publish(recipe_ids, **kwargs):
+    publish_changes(recipe_ids)
+
+
+# Поля пользователя, которые выводятся автором рецепта. Изменение прочих
+# (например, last_login при входе) не сбрасывает кеш ответов и фрагментов.
+AUTHOR_FIELDS = frozenset(('email', 'username', 'first_name', 'last_name'))
+
+
+def tag_dependencies(recipe, slugs):
+    return [f'list:author:{recipe.author_id}',
+            *(f'list:tag:{slug}' for slug in slugs)]
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved_invalidate(instance, created, using, **kwargs):
+    dependencies = [f'recipe:{instance.pk}']
+    if created:
+        dependencies += ['list', f'list:author:{instance.author_id}']
+    schedule_invalidation(dependencies, using)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted_invalidate(instance, using, **kwargs):
+    # Теги читаются до удаления: строки связи удаляются каскадом.
+    schedule_invalidation([
+        f'recipe:{instance.pk}', 'list',
+        *tag_dependencies(instance, instance.tags.values_list(
+            'slug', flat=True)),
+    ], using)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed_invalidate(instance, using, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    schedule_invalidation([f'recipe:{instance.recipe_id}'], using)
+    # Ключ фрагмента рецепта (api.fragments) зависит от времени изменения
+    # рецепта, а изменение состава в обход сериализатора (админка) его не
+    # обновляет.
+    Recipe.objects.using(using).filter(pk=instance.recipe_id).touch()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed_invalidate(instance, action, reverse, model,
+                                   pk_set, using, **kwargs):
+    if reverse or action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    tags = instance.tags.all() if action == 'pre_clear' else (
+        model.objects.filter(pk__in=pk_set))
+    schedule_invalidation([
+        f'recipe:{instance.pk}',
+        *tag_dependencies(instance, tags.values_list('slug', flat=True)),
+    ], using)
+    Recipe.objects.using(using).filter(pk=instance.pk).touch()
+
+
+@receiver(post_save, sender=User)
+def author_saved_invalidate(instance, update_fields, using, **kwargs):
+    if update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        schedule_invalidation([f'user:{instance.pk}'], using)
+        # Автор входит во фрагменты его рецептов (api.fragments).
+        Recipe.objects.using(using).filter(author=instance).touch()
+
+
+@receiver(recipes_imported, sender=Recipe)
+def recipes_imported_invalidate(recipe_ids, **kwargs):
+    recipes = Recipe.objects.filter(pk__in=recipe_ids)
+    schedule_invalidation([
+        'list',
+        *(f'list:author:{author_id}' for author_id in recipes.values_list(
+            'author_id', flat=True).distinct()),
+        *(f'list:tag:{slug}' for slug in Tag.objects.filter(
+            recipes__in=recipes).values_list('slug', flat=True).distinct()),
+    ])
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted_invalidate(instance, using, **kwargs):
+    # Выход через djoser и каскадное удаление вместе с пользователем.
+    transaction.on_commit(
+        lambda: token_cache.invalidate([instance.key]), using)
+
+
+@receiver(post_save, sender=User)
+def user_saved_invalidate_token(instance, update_fields, using, **kwargs):
+    """Смена пароля, блокировка и правка профиля сбрасывают снимок
+    пользователя; обновление одного last_login при входе — нет."""
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    keys = list(Token.objects.using(using).filter(
+        user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.invalidate(keys), using)
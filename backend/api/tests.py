@@ -0,0 +1,525 @@
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api.authentication import CachedTokenAuthentication, token_cache
+from api.cache import PendingInvalidation, schedule_invalidation, tags_catalog
+from api.filters import RecipeFilter
+from api.matching import get_matcher, publish_changes
+from api.renderers import FastJSONRenderer
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingListItem, Tag)
+from recipes.search import index_recipes
+from users.models import Subscription, User
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='foodgram-tests-')
+
+
+def clear_caches():
+    for alias_cache in caches.all():
+        alias_cache.clear()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        first_name='Имя', last_name='Фамилия', password='test-password')
+
+
+def create_recipes(author, count, tags=(), ingredients=()):
+    """Создаёт ``count`` рецептов автора с тегами и ингредиентами."""
+    Recipe.objects.bulk_create(
+        Recipe(author=author, name=f'Рецепт {number}', text='Описание',
+               cooking_time=10)
+        for number in range(count)
+    )
+    recipe_ids = list(Recipe.objects.filter(author=author).values_list(
+        'pk', flat=True).order_by('-pk')[:count])
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe_id, tag=tag)
+        for recipe_id in recipe_ids for tag in tags
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe_id=recipe_id, ingredient=ingredient,
+                         amount=10)
+        for recipe_id in recipe_ids for ingredient in ingredients
+    )
+    return recipe_ids
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    IMAGE_WORKERS=0,
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'responses': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'responses'},
+    },
+)
+class APITestBase(APITestCase):
+    """Пользователь с токеном, теги и ингредиенты"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        clear_caches()
+        self.user = create_user('user')
+        self.author = create_user('author')
+        self.tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag_{number}',
+                               color=Tag.BLUE)
+            for number in range(2)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+
+class RecipeListQueriesTest(APITestBase):
+    """Число запросов списка рецептов не зависит от числа рецептов"""
+
+    def assert_list_queries(self, count, queries):
+        create_recipes(self.author, count - Recipe.objects.count(),
+                       self.tags, self.ingredients)
+        # Кеши пусты: токен, теги и ингредиенты загружаются из базы.
+        clear_caches()
+        token_cache.clear()
+        with self.assertNumQueries(queries):
+            response = self.client.get('/api/recipes/', {'limit': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), count)
+
+    def test_authenticated(self):
+        for count in (1, 100):
+            with self.subTest(count=count):
+                self.assert_list_queries(count, 5)
+
+    def test_anonymous(self):
+        self.client.credentials()
+        for count in (1, 100):
+            with self.subTest(count=count):
+                self.assert_list_queries(count, 4)
+
+
+class ShoppingListConsistencyTest(APITestBase):
+    """Список покупок совпадает с суммами, посчитанными по корзинам"""
+
+    def setUp(self):
+        super().setUp()
+        self.own, self.other = (
+            create_recipes(author, 1, self.tags, self.ingredients[:2])[0]
+            for author in (self.user, self.author)
+        )
+
+    def assert_consistent(self):
+        self.assertEqual(
+            {(item.user_id, item.ingredient_id): item.amount
+             for item in ShoppingListItem.objects.all()},
+            ShoppingListItem.objects.expected_totals(),
+        )
+
+    def cart_url(self, recipe_id):
+        return f'/api/recipes/{recipe_id}/shopping_cart/'
+
+    def test_api(self):
+        for recipe_id in (self.own, self.other):
+            response = self.client.post(self.cart_url(recipe_id))
+            self.assertEqual(response.status_code, 201)
+            self.assert_consistent()
+        response = self.client.patch(f'/api/recipes/{self.own}/', {
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 25},
+                {'id': self.ingredients[1].id, 'amount': 10},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_consistent()
+        for _ in range(2):
+            response = self.client.delete(self.cart_url(self.other))
+            self.assertEqual(response.status_code, 204)
+            self.assert_consistent()
+        response = self.client.delete(f'/api/recipes/{self.own}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_consistent()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_direct_changes(self):
+        """Изменения в обход API, например из админки."""
+        cart = Cart.objects.create(user=self.author, recipe_id=self.own)
+        Cart.objects.create(user=self.user, recipe_id=self.own)
+        self.assert_consistent()
+        cart.recipe_id = self.other
+        cart.save()
+        self.assert_consistent()
+        item = RecipeIngredient.objects.filter(recipe_id=self.other).first()
+        item.amount = 777
+        item.save()
+        self.assert_consistent()
+        item.recipe_id, item.ingredient = self.own, self.ingredients[2]
+        item.save()
+        self.assert_consistent()
+        RecipeIngredient.objects.filter(recipe_id=self.own).first().delete()
+        self.assert_consistent()
+        Recipe.objects.get(pk=self.other).delete()
+        self.assert_consistent()
+        self.author.delete()
+        self.assert_consistent()
+        self.assertTrue(ShoppingListItem.objects.exists())
+        Recipe.objects.get(pk=self.own).delete()
+        self.assert_consistent()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+
+class RecipeWriteQueriesTest(APITestBase):
+    """Число запросов изменения и удаления рецепта не зависит от числа
+    удалённых строк состава и корзин"""
+
+    def setUp(self):
+        super().setUp()
+        self.ingredients += [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(40)
+        ]
+        self.customers = [create_user(f'customer_{number}')
+                          for number in range(5)]
+
+    def create_recipe(self, ingredients_count, carts_count):
+        recipe_id = create_recipes(
+            self.user, 1, self.tags,
+            self.ingredients[:ingredients_count])[0]
+        for customer in self.customers[:carts_count]:
+            Cart.objects.create(user=customer, recipe_id=recipe_id)
+        # Токен читается из базы один раз, до замеров.
+        self.client.get('/api/users/me/')
+        return recipe_id
+
+    def test_shrink_patch(self):
+        for ingredients_count, carts_count in ((5, 1), (40, 5)):
+            with self.subTest(ingredients=ingredients_count,
+                              carts=carts_count):
+                recipe_id = self.create_recipe(ingredients_count,
+                                               carts_count)
+                with self.assertNumQueries(18):
+                    response = self.client.patch(
+                        f'/api/recipes/{recipe_id}/', {'ingredients': [
+                            {'id': ingredient.id, 'amount': 5}
+                            for ingredient in self.ingredients[:2]
+                        ]}, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    ShoppingListItem.objects.filter(
+                        user__in=self.customers).count(), 2 * carts_count)
+
+    def test_delete(self):
+        for ingredients_count, carts_count in ((5, 1), (40, 5)):
+            with self.subTest(ingredients=ingredients_count,
+                              carts=carts_count):
+                recipe_id = self.create_recipe(ingredients_count,
+                                               carts_count)
+                with self.assertNumQueries(21):
+                    response = self.client.delete(
+                        f'/api/recipes/{recipe_id}/')
+                self.assertEqual(response.status_code, 204)
+                self.assertFalse(ShoppingListItem.objects.exists())
+
+
+class CatalogCacheTest(APITestBase):
+    """Версия справочника меняется только после фиксации транзакции"""
+
+    def test_version_changes_on_commit(self):
+        version = tags_catalog.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', slug='new', color=Tag.GREEN)
+            self.assertEqual(tags_catalog.version(), version)
+        self.assertNotEqual(tags_catalog.version(), version)
+
+    def test_invalidations_batched(self):
+        schedule_invalidation(['recipe:1'])
+        schedule_invalidation(['recipe:2', 'user:1'])
+        batches = [entry[1] for entry in connection.run_on_commit
+                   if isinstance(entry[1], PendingInvalidation)]
+        self.assertEqual(len(batches), 1)
+        self.assertLessEqual({'recipe:1', 'recipe:2', 'user:1'},
+                             batches[0].items)
+
+
+class RecipeFragmentsTest(APITestBase):
+    """Изменение состава в обход API обновляет фрагмент рецепта"""
+
+    def amounts(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['amount']
+                for item in response.json()['results'][0]['ingredients']}
+
+    def test_direct_ingredient_changes(self):
+        create_recipes(self.author, 1, self.tags, self.ingredients[:2])
+        first, second = self.ingredients[:2]
+        self.assertEqual(self.amounts(), {first.id: 10, second.id: 10})
+        item = RecipeIngredient.objects.get(ingredient=first)
+        item.amount = 25
+        item.save()
+        self.assertEqual(self.amounts(), {first.id: 25, second.id: 10})
+        RecipeIngredient.objects.get(ingredient=second).delete()
+        self.assertEqual(self.amounts(), {first.id: 25})
+
+    def test_fragments_do_not_evict_default_cache(self):
+        create_recipes(self.author, 10, self.tags, self.ingredients)
+        cache.set('matching:head', ('generation', 7), None)
+        response = self.client.get('/api/recipes/', {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.get('matching:head'), ('generation', 7))
+        self.assertFalse([key for key in cache._cache
+                          if 'fragments:' in key])
+        self.assertTrue([key for key in caches['responses']._cache
+                         if 'fragments:' in key])
+
+
+class FastJSONRendererTest(SimpleTestCase):
+    """Ответ совпадает с ответом стандартного JSONRenderer DRF"""
+
+    def test_non_str_keys_and_utc(self):
+        data = {
+            0: ['Ошибка'],
+            'created': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        }
+        content = FastJSONRenderer().render(data)
+        self.assertEqual(
+            content.decode(),
+            '{"0":["Ошибка"],"created":"2024-01-02T03:04:05Z"}')
+
+
+class CookableValidationTest(APITestBase):
+    """Ошибки проверки параметров отдаются ответом 400"""
+
+    def test_invalid_ingredients(self):
+        response = self.client.get('/api/recipes/cookable/',
+                                   {'ingredients': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.json())
+
+
+@mock.patch('api.matching._matcher', None)
+class MatcherJournalTest(APITestBase):
+    """Индекс подбора рецептов следует за журналом изменений"""
+
+    def matched(self, ingredient):
+        return [recipe_id for recipe_id, _, _
+                in get_matcher().match([ingredient.pk])[:10]]
+
+    def test_evicted_head_rebuilds_index(self):
+        first, second = self.ingredients[:2]
+        [recipe_id] = create_recipes(self.author, 1, ingredients=[first])
+        for _ in range(3):
+            publish_changes([recipe_id])
+        self.assertEqual(self.matched(first), [recipe_id])
+        # Голова и записи журнала вытеснены, новая запись получает номер,
+        # меньший версии индекса процесса.
+        cache.clear()
+        RecipeIngredient.objects.filter(recipe_id=recipe_id).update(
+            ingredient=second)
+        publish_changes([recipe_id])
+        self.assertEqual(self.matched(first), [])
+        self.assertEqual(self.matched(second), [recipe_id])
+
+
+class TokenCacheTest(APITestBase):
+    """В снимке пользователя нет хеша пароля"""
+
+    def test_password_not_cached(self):
+        token_cache.clear()
+        key = Token.objects.get(user=self.user).key
+        user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+        self.assertNotIn(self.user.password, repr(token_cache.get(key)))
+        self.assertIn('password', user.get_deferred_fields())
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'test-password',
+            'new_password': 'New-password-2024',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('New-password-2024'))
+
+
+class CounterFieldsTest(APITestBase):
+    """Полное сохранение не откатывает счётчики"""
+
+    def test_patch_after_favorite(self):
+        recipe_id = create_recipes(self.user, 1, self.tags,
+                                   self.ingredients)[0]
+        recipe = Recipe.objects.get(pk=recipe_id)
+        Favorite.objects.create(user=self.author, recipe=recipe)
+        recipe.name = 'Новое название'
+        recipe.save()
+        response = self.client.patch(f'/api/recipes/{recipe_id}/',
+                                     {'name': 'Ещё название'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Ещё название')
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_user_save(self):
+        user = User.objects.get(pk=self.author.pk)
+        create_recipes(self.author, 1)
+        User.objects.filter(pk=user.pk).update(recipes_count=1)
+        user.first_name = 'Другое'
+        user.save()
+        user.refresh_from_db()
+        self.assertEqual(user.recipes_count, 1)
+
+
+class LimitPerAuthorTest(APITestBase):
+    """В подписках выводятся последние recipes_limit рецептов автора"""
+
+    def test_limit(self):
+        other = create_user('other')
+        newest = {
+            author.pk: create_recipes(author, 5)[:3]
+            for author in (self.author, other)
+        }
+        Subscription.objects.bulk_create(
+            Subscription(user=self.user, author=author)
+            for author in (self.author, other)
+        )
+        response = self.client.get('/api/users/subscriptions/',
+                                   {'recipes_limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {author['id']: [recipe['id'] for recipe in author['recipes']]
+             for author in response.json()['results']},
+            newest,
+        )
+        self.assertFalse(Recipe.objects.limit_per_author(0).exists())
+
+
+class RecipeFilterTest(APITestBase):
+    """Сочетания фильтров: верный состав без дублей и лишних JOIN"""
+
+    def setUp(self):
+        super().setUp()
+        both, first, second = (
+            [tag.slug for tag in tags] for tags in (
+                self.tags, self.tags[:1], self.tags[1:])
+        )
+        self.recipes = {
+            name: create_recipes(author, 1, tags)[0]
+            for name, author, tags in (
+                ('both', self.author, self.tags),
+                ('first', self.author, self.tags[:1]),
+                ('own', self.user, self.tags[1:]),
+                ('untagged', self.author, ()),
+            )
+        }
+        self.slugs = {'both': both, 'first': first, 'second': second}
+        for model, names in ((Favorite, ('both', 'first')),
+                             (Cart, ('both', 'own'))):
+            model.objects.bulk_create(
+                model(user=self.user, recipe_id=self.recipes[name])
+                for name in names
+            )
+
+    def filter_queryset(self, params):
+        request = RequestFactory().get('/api/recipes/', params)
+        request.user = self.user
+        return RecipeFilter(
+            request.GET, request=request,
+            queryset=Recipe.objects.all()).qs
+
+    def test_combinations(self):
+        cases = (
+            ({'tags': self.slugs['both']}, ('both', 'first', 'own')),
+            ({'tags': self.slugs['both'], 'is_favorited': 1},
+             ('both', 'first')),
+            ({'tags': self.slugs['both'], 'is_in_shopping_cart': 1},
+             ('both', 'own')),
+            ({'is_favorited': 1, 'is_in_shopping_cart': 1}, ('both',)),
+            ({'author': self.author.pk, 'tags': self.slugs['second'],
+              'is_in_shopping_cart': 1}, ('both',)),
+            ({'author': self.author.pk, 'is_favorited': 0}, ('untagged',)),
+            ({'tags': self.slugs['first'], 'is_favorited': 1,
+              'is_in_shopping_cart': 0}, ('first',)),
+        )
+        for params, names in cases:
+            with self.subTest(params=params):
+                response = self.client.get('/api/recipes/', params)
+                self.assertEqual(response.status_code, 200)
+                data = response.json()
+                ids = [recipe['id'] for recipe in data['results']]
+                self.assertEqual(data['count'], len(names))
+                self.assertCountEqual(
+                    ids, [self.recipes[name] for name in names])
+
+                query = self.filter_queryset(params).query
+                # Фильтры не присоединяют таблиц к основному запросу.
+                self.assertEqual(
+                    {alias for alias in query.alias_map
+                     if query.alias_refcount[alias]},
+                    {Recipe._meta.db_table})
+                self.assertFalse(query.distinct)
+
+
+class SearchPaginationTest(APITestBase):
+    """Результаты поиска с курсором остаются упорядоченными по
+    релевантности"""
+
+    def test_cursor_keeps_rank_order(self):
+        in_name = Recipe.objects.create(
+            author=self.author, name='Томатный суп', text='Описание',
+            cooking_time=10)
+        in_text = Recipe.objects.create(
+            author=self.author, name='Обед', text='Подаётся как суп',
+            cooking_time=10)
+        index_recipes([in_name.pk, in_text.pk])
+        ids = []
+        response = self.client.get('/api/recipes/', {
+            'search': 'суп', 'pagination': 'cursor', 'limit': 1})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids.extend(recipe['id'] for recipe in data['results'])
+            if not data['next']:
+                break
+            response = self.client.get(data['next'])
+        self.assertEqual(ids, [in_name.pk, in_text.pk])
+
+
+class GenerateThumbnailsTest(APITestBase):
+    """Команда создаёт копии всем рецептам и при работе пула потоков"""
+
+    @override_settings(IMAGE_WORKERS=2)
+    def test_command(self):
+        buffer = BytesIO()
+        Image.new('RGB', (400, 300)).save(buffer, 'JPEG')
+        name = Recipe._meta.get_field('image').storage.save(
+            'media/test.jpg', ContentFile(buffer.getvalue()))
+        recipe_ids = create_recipes(self.author, 3)
+        Recipe.objects.filter(pk__in=recipe_ids).update(image=name)
+        # Закрытие соединений оборвало бы курсор ``iterator()`` команды.
+        with mock.patch('api.images.connections.close_all') as close_all:
+            call_command('generate_thumbnails', stdout=StringIO())
+        close_all.assert_not_called()
+        self.assertFalse(Recipe.objects.filter(
+            Q(thumbnail__isnull=True) | Q(thumbnail=''),
+            pk__in=recipe_ids).exists())
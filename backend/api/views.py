@@ -1,7 +1,8 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
@@ -9,18 +10,31 @@ from rest_framework.permissions import (SAFE_METHODS, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
-from .filters import IngredientSearchFilter, RecipeFilter
-from .mixins import CreateListViewSet
-from .pagination import LimitPageNumberPaginator
+from recipes.feed import feed_recipe_ids
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            ShoppingListItem, Tag)
+from recipes.signals import recipe_rewrite
+from .autocomplete import DEFAULT_LIMIT, MAX_LIMIT, autocomplete
+from .cache import (CATALOG_DEPENDENCIES, ingredients_catalog,
+                    list_dependencies, recipe_dependencies, recipe_responses,
+                    tags_catalog)
+from .exporters import EXPORTERS
+from .filters import IngredientSearchFilter, RecipeFilter, RecipeOrderingFilter
+from .matching import get_matcher
+from .mixins import CreateListViewSet, SubscriptionsMixin, ViewerRelationsMixin
+from .pagination import FeedPaginator, LimitPageNumberPaginator
 from .permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
-from .serializers import (CartSerializer, FavoriteSerializer,
-                          IngredientSerializer, RecipeIngredient,
-                          RecipeSerializer, RecipeWriteSerializer,
-                          SubscribeSerializer, TagSerializer)
+from .serializers import (CartSerializer, CookableQuerySerializer,
+                          CookableRecipeSerializer, FavoriteSerializer,
+                          IngredientSerializer, RecipeSerializer,
+                          RecipeWriteSerializer, SubscribeSerializer,
+                          TagSerializer)
 
 User = get_user_model
 
+# Параметры списка рецептов, ответы с которыми кешируются для анонимов.
+CACHED_PARAMS = frozenset(('tags', 'author', 'page', 'limit'))
+
 
 class TagViewSet(viewsets.ModelViewSet):
     """Вьюсет модели Tag"""
@@ -30,6 +44,18 @@ class TagViewSet(viewsets.ModelViewSet):
     http_method_names = ('get',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return tags_catalog.response(
+            request, 'list',
+            lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return tags_catalog.response(
+            request, f'detail:{kwargs["pk"]}',
+            lambda: self.get_serializer(self.get_object()).data
+        )
+
 
 class IngredientViewSet(viewsets.ModelViewSet):
     """Вьюсет модели Ingredient"""
@@ -40,25 +66,138 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filterset_class = IngredientSearchFilter
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        return ingredients_catalog.response(
+            request, 'list',
+            lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return ingredients_catalog.response(
+            request, f'detail:{kwargs["pk"]}',
+            lambda: self.get_serializer(self.get_object()).data
+        )
 
-class RecipeViewSet(viewsets.ModelViewSet):
+    @action(methods=['GET'], detail=False, filter_backends=())
+    def autocomplete(self, request):
+        name = request.query_params.get('name', '').strip()
+        try:
+            limit = int(request.query_params.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            return Response({'limit': 'Укажите целое число.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not name:
+            return Response([])
+        return Response(autocomplete(name, max(1, min(limit, MAX_LIMIT))))
+
+
+class RecipeViewSet(ViewerRelationsMixin, viewsets.ModelViewSet):
     """Вьюсет модели Recipe"""
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthorOrReadOnly,)
     http_method_names = ('get', 'post', 'patch', 'delete')
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('id', 'favorites_count', 'carts_count')
+    ordering = ('-id',)
     pagination_class = LimitPageNumberPaginator
 
+    def get_queryset(self):
+        if self.request.method not in SAFE_METHODS:
+            # Изменение и удаление перечитывают состав рецепта сами.
+            return Recipe.objects.select_related('author')
+        # Теги и ингредиенты подгружаются сериализатором только для
+        # рецептов, которых нет в кеше фрагментов.
+        return Recipe.objects.select_related('author').with_user_flags(
+            self.request.user)
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeSerializer
         return RecipeWriteSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # В списках отдаём уменьшенные копии изображений.
+        context['original_images'] = self.action not in (
+            'list', 'cookable', 'feed')
+        return context
+
+    def cached_params(self):
+        """Нормализованные параметры запроса для кеша ответов или None,
+        если ответ зависит от пользователя или от других параметров."""
+        request = self.request
+        params = request.query_params
+        if (not request.user.is_anonymous
+                or request.accepted_renderer.format != 'json'
+                or not CACHED_PARAMS.issuperset(params)):
+            return None
+        try:
+            numbers = {
+                name: int(params[name]) for name in ('author', 'page', 'limit')
+                if params.get(name)
+            }
+        except ValueError:
+            return None
+        numbers.setdefault('page', 1)
+        numbers.setdefault('limit', self.paginator.page_size)
+        numbers['tags'] = sorted(set(params.getlist('tags')) - {''})
+        return numbers
+
+    def cached_response(self, request, variant, view, dependencies, many):
+        def build():
+            data = view().data
+            return data, recipe_dependencies(
+                data['results'] if many else [data])
+
+        return recipe_responses.response(
+            request, variant, build, (*CATALOG_DEPENDENCIES, *dependencies))
+
+    def list(self, request, *args, **kwargs):
+        params = self.cached_params()
+        view = super().list
+        if params is None:
+            return view(request, *args, **kwargs)
+        return self.cached_response(
+            request,
+            ('list', *(f'{name}={params.get(name)}' for name in sorted(
+                CACHED_PARAMS))),
+            lambda: view(request, *args, **kwargs),
+            list_dependencies(params.get('author'), params['tags']),
+            many=True,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        view = super().retrieve
+        if self.cached_params() is None or not kwargs['pk'].isdigit():
+            return view(request, *args, **kwargs)
+        pk = int(kwargs['pk'])
+        return self.cached_response(
+            request, ('detail', str(pk)),
+            lambda: view(request, *args, **kwargs),
+            [f'recipe:{pk}'], many=False,
+        )
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Блокировка строки рецепта не даёт параллельно положить его в
+        # корзину, пока рецепт убирается из списков покупок.
+        list(Recipe.objects.select_for_update().filter(
+            pk=instance.pk).order_by().values_list('pk'))
+        ShoppingListItem.objects.change_recipe(
+            instance.pk, ShoppingListItem.objects.recipe_amounts(instance.pk),
+            {})
+        # Счётчики удаляемого рецепта и списки покупок по строкам состава и
+        # корзин не пересчитываются.
+        with recipe_rewrite(instance.pk):
+            instance.delete()
+
     @staticmethod
     def favorite_and_shopping_cart_add(model, user, recipe, serializer):
         model_create, create = model.objects.get_or_create(user=user,
@@ -71,8 +210,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return None
 
     @staticmethod
+    @transaction.atomic
     def favorite_and_shopping_cart_delete(model, user, recipe):
-        model.objects.filter(recipe=recipe, user=user).delete()
+        # Строка блокируется до удаления: из параллельных запросов её
+        # удалит только первый, и сигналы post_delete (счётчики, список
+        # покупок) сработают один раз.
+        locked = model.objects.select_for_update().filter(
+            recipe=recipe, user=user).values_list('pk', flat=True)
+        model.objects.filter(pk__in=list(locked)).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -98,6 +243,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=True,
         permission_classes=(IsAuthenticated,)
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk=None):
         user = request.user
         recipe = get_object_or_404(Recipe, pk=pk)
@@ -109,43 +255,96 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 Cart, user, recipe)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        """Рецепты, которые можно приготовить из переданных ингредиентов:
+        сначала с наибольшей долей имеющихся, затем с меньшим числом
+        недостающих."""
+        params = CookableQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        ranked = get_matcher().match(
+            params.validated_data['ingredients'],
+            params.validated_data.get('max_missing'),
+        )
+        page = self.paginate_queryset(ranked)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        results = []
+        for recipe_id, coverage, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage, recipe.missing = coverage, missing
+                results.append(recipe)
+        serializer = CookableRecipeSerializer(
+            results, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False,
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Последние рецепты авторов, на которых подписан пользователь."""
+        paginator = FeedPaginator()
+        recipe_ids = paginator.paginate_ids(
+            lambda limit, before: feed_recipe_ids(
+                request.user, limit, before),
+            request,
+        )
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     @action(methods=['GET'],
             detail=False,
             permission_classes=(IsAuthenticated,)
             )
     def download_shopping_cart(self, request):
-        file_name = 'shopping_list.txt'
-        user = request.user
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__cart__user=user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(ingredient_sum=Sum('amount')).values_list(
-            'ingredient__name', 'ingredient__measurement_unit',
-            'ingredient_sum')
-        content = ''
-        for ingredient in ingredients:
-            content += (
-                f'{ingredient[0]} '
-                f'{ingredient[2]} '
-                f'- {ingredient[1]}\r\n'
+        exporter_class = EXPORTERS.get(request.query_params.get('type', 'txt'))
+        if exporter_class is None:
+            return Response(
+                {'errors': 'Доступные форматы: ' + ', '.join(EXPORTERS)},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        response = HttpResponse(
-            content, content_type='text/plain', charset='utf-8'
+        exporter = exporter_class()
+        # Строки читаются из базы один раз (их не больше числа ингредиентов
+        # в каталоге), а файл собирается из них по частям уже без базы:
+        # под ASGI Django перебирает потоковый ответ в цикле событий, где
+        # обращаться к базе нельзя.
+        rows = list(ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name', 'ingredient__measurement_unit'))
+        etag = exporter.etag(rows)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = StreamingHttpResponse(
+            exporter.render(rows),
+            content_type=exporter.content_type
         )
-        response['Content-Disposition'] = f'attachment; filename={file_name}'
+        response['ETag'] = etag
+        response['Content-Disposition'] = (
+            f'attachment; filename=shopping_list.{exporter.extension}')
         return response
 
 
-class SubscribeViewSet(CreateListViewSet):
+class SubscribeViewSet(ViewerRelationsMixin, SubscriptionsMixin,
+                       CreateListViewSet):
     """Вьюсет модели Subscription."""
     serializer_class = SubscribeSerializer
     permission_classes = (IsAuthenticated,)
     filter_backends = [filters.SearchFilter]
-    search_fields = ('user__username', 'author__username')
+    search_fields = ('username',)
+    pagination_class = LimitPageNumberPaginator
 
     def get_queryset(self):
-        return self.request.user.follower.all()
+        return self.get_subscriptions(self.get_recipes_limit())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipes_limit'] = self.get_recipes_limit()
+        return context
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
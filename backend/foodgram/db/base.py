@@ -0,0 +1,144 @@
+"""Постоянные соединения с базой: проверка и пул.
+
+Бэкенды ``foodgram.db.postgresql`` и ``foodgram.db.sqlite3`` (последний —
+для локальных замеров) дополняют стандартные бэкенды Django двумя
+возможностями, которых нет в Django 3.2:
+
+* ``CONN_HEALTH_CHECKS`` — соединение, оставшееся с прошлого запроса
+  (``CONN_MAX_AGE`` больше 0), проверяется перед первым запросом к базе
+  в новом HTTP-запросе и переоткрывается, если база его закрыла
+  (перезапуск, разрыв по таймауту). Так же это сделано в Django 4.1.
+* ``POOL_SIZE`` — соединения, закрытые Django, возвращаются в пул
+  процесса, общий для всех потоков, и выдаются следующему потоку без
+  установки нового соединения. Пул нужен воркерам с потоками (gunicorn
+  ``--threads``): с ним число соединений ограничено ``POOL_SIZE``, а не
+  числом потоков. Поток, не получивший соединение за ``POOL_TIMEOUT``
+  секунд, получает ``OperationalError``. При пуле ``CONN_MAX_AGE`` стоит
+  оставить 0, чтобы соединение возвращалось в пул после каждого запроса.
+"""
+import os
+import threading
+from collections import Counter
+from functools import partial
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Свободные соединения с базой, общие для потоков процесса"""
+
+    def __init__(self, size, timeout):
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.stats = Counter()
+
+    def acquire(self, connect):
+        """Возвращает ``(соединение, взято ли оно из пула)``; новое
+        соединение открывается через ``connect``."""
+        if not self.slots.acquire(timeout=self.timeout):
+            self.stats['timeout'] += 1
+            raise PoolTimeout(
+                f'Нет свободного соединения за {self.timeout} с.')
+        with self.lock:
+            if self.idle:
+                self.stats['reused'] += 1
+                return self.idle.pop(), True
+        try:
+            connection = connect()
+        except BaseException:
+            self.slots.release()
+            raise
+        self.stats['created'] += 1
+        return connection, False
+
+    def release(self, connection, discard=False):
+        try:
+            if discard:
+                self.stats['discarded'] += 1
+                connection.close()
+            else:
+                with self.lock:
+                    self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+
+def get_pool(alias, settings_dict):
+    size = settings_dict.get('POOL_SIZE') or 0
+    if size <= 0:
+        return None
+    # Пул не переживает fork: у воркера должны быть свои соединения.
+    key = (os.getpid(), alias)
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool = pools[key] = ConnectionPool(
+                size, settings_dict.get('POOL_TIMEOUT', 30))
+    return pool
+
+
+class PersistentConnectionMixin:
+    """Проверка постоянных соединений и пул для ``DatabaseWrapper``"""
+
+    health_check_done = False
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def connect(self):
+        self.reused = False
+        super().connect()
+        # Новое соединение проверять не нужно, взятое из пула — нужно.
+        self.health_check_done = not self.reused
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            connection, self.reused = pool.acquire(
+                partial(super().get_new_connection, conn_params))
+        except PoolTimeout as error:
+            raise self.Database.OperationalError(str(error))
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        # Незавершённая транзакция не должна достаться следующему потоку,
+        # а соединение, закрытое внутри atomic, ещё числится за этим.
+        discard = self.errors_occurred or self.in_atomic_block
+        if not discard:
+            try:
+                self.connection.rollback()
+            except self.Database.Error:
+                discard = True
+        pool.release(self.connection, discard)
+
+    def close_if_unusable_or_obsolete(self):
+        if self.connection is not None:
+            self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def close_if_health_check_failed(self):
+        if (self.connection is None
+                or not self.settings_dict.get('CONN_HEALTH_CHECKS')
+                or self.health_check_done):
+            return
+        if not self.is_usable():
+            self.errors_occurred = True
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
@@ -0,0 +1,25 @@
+class CounterFieldsMixin:
+    """Модель со счётчиками, которые меняются запросами UPDATE с
+    F-выражениями (см. ``recipes.signals.change_counter``).
+
+    ``save()`` существующей строки не записывает поля ``counter_fields``:
+    загруженные вместе с объектом значения могли устареть, и полное
+    сохранение (правка рецепта, админка) откатило бы счётчики. Чтобы
+    записать счётчик, его нужно передать в ``update_fields`` явно.
+    """
+    counter_fields = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if (update_fields is None and not force_insert
+                and not self._state.adding and self.pk is not None):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name not in self.counter_fields
+            ]
+        return super().save(force_insert=force_insert,
+                            force_update=force_update, using=using,
+                            update_fields=update_fields)
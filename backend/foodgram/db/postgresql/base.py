@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from foodgram.db.base import PersistentConnectionMixin
+
+
+class DatabaseWrapper(PersistentConnectionMixin, base.DatabaseWrapper):
+    """PostgreSQL с проверкой постоянных соединений и пулом"""
@@ -0,0 +1,37 @@
+from django.db import transaction
+
+
+class OnCommitBatch:
+    """Элементы, накопленные за транзакцию и обрабатываемые одним вызовом
+    ``process()`` после её фиксации.
+
+    ``add()`` внутри транзакции дополняет уже запланированный пакет того же
+    класса, вне транзакции — обрабатывает элементы сразу. Если транзакция
+    откатится, Django отбросит пакет вместе с остальными обработчиками
+    ``on_commit``.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.items = set()
+
+    def __call__(self):
+        self.process(self.items)
+
+    def process(self, items):
+        raise NotImplementedError
+
+    @classmethod
+    def add(cls, items, using='default'):
+        connection = transaction.get_connection(using)
+        if not connection.in_atomic_block:
+            cls(using).process(set(items))
+            return
+        batch = next((
+            entry[1] for entry in connection.run_on_commit
+            if type(entry[1]) is cls
+        ), None)
+        if batch is None:
+            batch = cls(using)
+            transaction.on_commit(batch, using)
+        batch.items.update(items)
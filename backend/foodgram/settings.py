@@ -9,7 +9,13 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = str(os.getenv('SECRET_KEY'))
 
-DEBUG = False
+DEBUG = os.getenv('DEBUG', default='False').lower() == 'true'
+
+# Замеры запросов (Server-Timing, /metrics, журнал медленных запросов);
+# выключенные не добавляют накладных расходов.
+INSTRUMENTATION = os.getenv(
+    'INSTRUMENTATION', default='False').lower() == 'true'
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', default=500))
 
 ALLOWED_HOSTS = ['*']
 
@@ -31,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,15 +67,25 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Соединение с базой живёт DB_CONN_MAX_AGE секунд (0 — закрывается после
+# каждого запроса) и проверяется в начале запроса, если оно осталось с
+# прошлого. Для воркеров с потоками можно включить пул соединений процесса
+# размером DB_POOL_SIZE (см. foodgram.db.base); проверка и пул работают с
+# бэкендами foodgram.db.postgresql и foodgram.db.sqlite3.
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE',
-                            default='django.db.backends.postgresql'),
+        'ENGINE': os.getenv('DB_ENGINE', default='foodgram.db.postgresql'),
         'NAME': os.getenv('DB_NAME', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='post'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default=5432)
+        'PORT': os.getenv('DB_PORT', default=5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', default='True').lower() == 'true',
+        'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', default=0)),
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=30)),
+        'TEST': {'NAME': os.getenv('DB_TEST_NAME')},
     }
 }
 
@@ -79,6 +96,63 @@ DATABASES = {
 #     }
 # }
 
+# Кеш должен быть общим для всех воркеров gunicorn: в нём хранятся версии
+# справочников, по которым сбрасываются копии в памяти процессов, и журнал
+# подбора рецептов (api.matching). Записей в нём немного, но вытеснять их
+# нельзя, поэтому предел выше 300 записей FileBasedCache по умолчанию.
+FILE_CACHE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', default=FILE_CACHE_BACKEND),
+        'LOCATION': os.getenv('CACHE_LOCATION',
+                              default=os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES',
+                                         default=10000)),
+        },
+    }
+}
+# Ответы API для анонимных пользователей и фрагменты рецептов
+# (api.fragments) хранятся отдельно: их много, и вытесняться должны они,
+# а не версии и журнал из кеша по умолчанию. Отдельное хранилище (например,
+# Redis) задаётся RESPONSE_CACHE_BACKEND, иначе используется бэкенд кеша
+# по умолчанию (для файлового — в подкаталоге responses). Предел по
+# умолчанию рассчитан на фрагменты нескольких тысяч рецептов; FileBasedCache
+# перечисляет файлы каталога при каждой записи, поэтому для большего
+# каталога лучше Redis.
+RESPONSE_CACHE = 'responses'
+CACHES[RESPONSE_CACHE] = {
+    'BACKEND': os.getenv('RESPONSE_CACHE_BACKEND',
+                         default=CACHES['default']['BACKEND']),
+    'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', default=(
+        os.path.join(CACHES['default']['LOCATION'], 'responses')
+        if not os.getenv('RESPONSE_CACHE_BACKEND')
+        and CACHES['default']['BACKEND'] == FILE_CACHE_BACKEND
+        else CACHES['default']['LOCATION'])),
+    'KEY_PREFIX': 'responses',
+    'OPTIONS': {
+        'MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES',
+                                     default=20000)),
+    },
+}
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT',
+                                       default=300))
+# Снимки токенов и пользователей для api.authentication хранятся в памяти
+# процесса; общее хранилище для всех процессов (например, Redis) задаётся
+# AUTH_TOKEN_CACHE_BACKEND. Время жизни ограничивает, сколько отозванный
+# токен может действовать в других процессах.
+AUTH_TOKEN_CACHE = None
+if os.getenv('AUTH_TOKEN_CACHE_BACKEND'):
+    AUTH_TOKEN_CACHE = 'auth_tokens'
+    CACHES[AUTH_TOKEN_CACHE] = {
+        'BACKEND': os.getenv('AUTH_TOKEN_CACHE_BACKEND'),
+        'LOCATION': os.getenv('AUTH_TOKEN_CACHE_LOCATION', default=''),
+    }
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE',
+                                      default=10000))
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT',
+                                         default=60))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.'
@@ -122,7 +196,18 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    # JSON кодируется и разбирается через orjson, если он установлен.
+    # Браузерная версия API включается только в режиме отладки.
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        *(['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.PageNumberPagination',
@@ -146,3 +231,17 @@ DJOSER = {
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Обработка изображений рецептов: максимальный размер загрузки в байтах,
+# размер уменьшенной копии для списков и число фоновых потоков (0 —
+# обрабатывать синхронно в потоке запроса).
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv('MAX_IMAGE_UPLOAD_SIZE',
+                                      default=10 * 1024 * 1024))
+THUMBNAIL_SIZE = (480, 480)
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+
+# Лента подписок: рецепты авторов, у которых подписчиков больше
+# FEED_FANOUT_LIMIT, не записываются в ленты, а читаются при запросе;
+# при подписке в ленту переносятся последние FEED_BACKFILL рецептов.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', default=10000))
+FEED_BACKFILL = 100
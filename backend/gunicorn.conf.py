@@ -0,0 +1,17 @@
+"""Настройки gunicorn.
+
+``SERVER_MODE=asgi`` запускает ``foodgram.asgi`` в воркерах uvicorn:
+медленные клиенты и большие ответы не занимают воркер. По умолчанию —
+``foodgram.wsgi`` в синхронных воркерах.
+"""
+import os
+
+bind = '0:8000'
+workers = int(os.getenv('GUNICORN_WORKERS', default=1))
+
+if os.getenv('SERVER_MODE') == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    threads = int(os.getenv('GUNICORN_THREADS', default=1))
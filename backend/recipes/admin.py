@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Cart, Favorite, Ingredient, Recipe, RecipeIngredient, Tag
+from .models import (Cart, Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingListItem, Tag)
 
 
 @admin.register(Tag)
@@ -28,7 +29,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='В избранном')
     def count_favorites(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
 
 @admin.register(RecipeIngredient)
@@ -47,3 +48,9 @@ class FavoriteAdmin(admin.ModelAdmin):
 class CartAdmin(admin.ModelAdmin):
     list_display = ('pk', 'recipe', 'user')
     list_editable = ('recipe', 'user')
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'user', 'ingredient', 'amount')
+    list_filter = ('user',)
@@ -0,0 +1,102 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+Лента хранится в таблице ``TimelineEntry``: при публикации рецепта он
+добавляется в ленты всех подписчиков автора одним запросом
+INSERT ... SELECT (fan-out on write), а при подписке в ленту переносятся
+последние ``FEED_BACKFILL`` рецептов автора. Авторам, у которых
+подписчиков больше ``FEED_FANOUT_LIMIT``, такая запись обходится слишком
+дорого: их рецепты в таблицу не попадают, а при чтении ленты выбираются
+по индексу (author, id) и объединяются с записями таблицы (fan-out on
+read).
+
+Лента упорядочена по убыванию id рецепта и листается по ключу: следующая
+страница начинается с рецептов старше последнего показанного.
+"""
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Value
+
+from users.models import Subscription
+from .models import Recipe, TimelineEntry
+
+
+def insert_entries(rows, using='default'):
+    """Вставляет в ленты строки ``(user_id, recipe_id, author_id)`` из
+    queryset одним запросом, пропуская уже существующие. Возвращает
+    число добавленных строк."""
+    connection = connections[using]
+    sql, params = rows.query.sql_with_params()
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(TimelineEntry._meta.get_field(name).column)
+        for name in ('user', 'recipe', 'author')
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{connection.ops.insert_statement(ignore_conflicts=True)} '
+            f'{quote(TimelineEntry._meta.db_table)} ({columns}) {sql} '
+            f'{connection.ops.ignore_conflicts_suffix_sql(True)}',
+            params,
+        )
+        return cursor.rowcount
+
+
+def fan_out(recipe_ids, using='default'):
+    """Добавляет рецепты в ленты подписчиков их авторов."""
+    return insert_entries(Subscription.objects.using(using).filter(
+        author__recipes__in=list(recipe_ids),
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).values_list('user_id', 'author__recipes__id', 'author_id'), using)
+
+
+def backfill(user_id, author_id, using='default'):
+    """Переносит в ленту нового подписчика последние рецепты автора."""
+    # Аннотации идут в SELECT после полей модели, поэтому все три
+    # столбца задаются аннотациями в порядке столбцов таблицы.
+    return insert_entries(Recipe.objects.using(using).filter(
+        author_id=author_id,
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).annotate(
+        entry_user=Value(user_id), entry_recipe=F('pk'),
+        entry_author=F('author_id'),
+    ).order_by('-pk').values_list(
+        'entry_user', 'entry_recipe', 'entry_author'
+    )[:settings.FEED_BACKFILL], using)
+
+
+@transaction.atomic
+def rebuild_timelines(user_ids=None):
+    """Заново заполняет ленты пользователей (всех, если ``user_ids`` не
+    задан) всеми рецептами авторов, на которых они подписаны."""
+    entries = TimelineEntry.objects.all()
+    subscriptions = Subscription.objects.filter(
+        author__recipes__isnull=False,
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+    )
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        subscriptions = subscriptions.filter(user_id__in=user_ids)
+    entries.delete()
+    return insert_entries(subscriptions.values_list(
+        'user_id', 'author__recipes__id', 'author_id'))
+
+
+def feed_recipe_ids(user, limit, before=None):
+    """id не более ``limit`` рецептов ленты старше ``before`` по убыванию."""
+    entries = TimelineEntry.objects.filter(user=user)
+    if before is not None:
+        entries = entries.filter(recipe_id__lt=before)
+    ids = set(entries.order_by('-recipe_id').values_list(
+        'recipe_id', flat=True)[:limit])
+    popular = list(Subscription.objects.filter(
+        user=user, author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).values_list('author_id', flat=True))
+    if popular:
+        recipes = Recipe.objects.filter(author_id__in=popular)
+        if before is not None:
+            recipes = recipes.filter(pk__lt=before)
+        # Рецепты автора, набравшего подписчиков после публикации, могут
+        # оказаться и в таблице, поэтому id объединяются без повторов.
+        ids.update(recipes.order_by('-pk').values_list(
+            'pk', flat=True)[:limit])
+    return sorted(ids, reverse=True)[:limit]
@@ -0,0 +1,147 @@
+"""Загрузка справочников (ингредиенты, теги) из CSV и JSON.
+
+Файл сравнивается с таблицей по естественному ключу: новые строки
+вставляются, изменившиеся обновляются, остальные не трогаются, поэтому
+повторный запуск ничего не меняет. Изменения применяются пачками, каждая
+в своей короткой транзакции.
+"""
+import csv
+import json
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from .signals import catalog_changed
+from .transfer import batched
+
+FORMATS = ('csv', 'json', 'jsonl')
+
+
+def detect_format(path, file_format=None):
+    if file_format:
+        return file_format
+    for extension in FORMATS:
+        if path.lower().endswith(f'.{extension}'):
+            return extension
+    return 'csv'
+
+
+class CatalogLoadCommand(BaseCommand):
+    """Основа команд загрузки справочника ``model``.
+
+    ``fields`` — поля в порядке колонок CSV, ``key_fields`` — естественный
+    ключ, по которому строки файла сопоставляются с таблицей.
+    """
+    model = None
+    fields = ()
+    key_fields = ()
+    default_path = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=self.default_path,
+                            help='Файл справочника.')
+        parser.add_argument('--format', choices=FORMATS, dest='file_format',
+                            help='Формат файла (по умолчанию по расширению).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Строк в одной транзакции.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать изменения.')
+
+    @property
+    def value_fields(self):
+        return [
+            field for field in self.fields if field not in self.key_fields]
+
+    def read_rows(self, path, file_format):
+        """Возвращает пары ``(номер строки, словарь полей)``."""
+        with open(path, encoding='utf-8', newline='') as file:
+            if file_format == 'json':
+                rows = enumerate(json.load(file), 1)
+            elif file_format == 'jsonl':
+                rows = (
+                    (number, json.loads(line))
+                    for number, line in enumerate(file, 1) if line.strip()
+                )
+            else:
+                rows = (
+                    (number, dict(zip(self.fields, line)))
+                    for number, line in enumerate(csv.reader(file), 1)
+                    if line
+                )
+            for number, row in rows:
+                yield number, {
+                    field: str(row.get(field) or '').strip()
+                    for field in self.fields
+                }
+
+    def diff(self, rows):
+        """Сравнивает строки файла с таблицей и возвращает объекты для
+        вставки и обновления, количество неизменных и отсутствующих."""
+        existing = {
+            tuple(getattr(obj, field) for field in self.key_fields): obj
+            for obj in self.model.objects.only('pk', *self.fields).iterator()
+        }
+        value_fields = self.value_fields
+        inserts, updates, unchanged, seen = [], [], 0, set()
+        for number, row in rows:
+            key = tuple(row[field] for field in self.key_fields)
+            if key in seen:
+                continue
+            seen.add(key)
+            obj = existing.get(key)
+            if obj is None:
+                obj = self.model(**row)
+                inserts.append(obj)
+            elif any(getattr(obj, field) != row[field]
+                     for field in value_fields):
+                for field in value_fields:
+                    setattr(obj, field, row[field])
+                updates.append(obj)
+            else:
+                unchanged += 1
+                continue
+            try:
+                obj.clean_fields()
+            except ValidationError as error:
+                raise CommandError(f'Строка {number}: {error}')
+        return inserts, updates, unchanged, len(existing.keys() - seen)
+
+    def apply(self, objects, batch_size, write):
+        done = 0
+        for batch in batched(objects, batch_size):
+            with transaction.atomic():
+                write(batch)
+            done += len(batch)
+            self.stdout.write(f'  {done} из {len(objects)}')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = detect_format(path, options['file_format'])
+        started = time.monotonic()
+        try:
+            inserts, updates, unchanged, absent = self.diff(
+                self.read_rows(path, file_format))
+        except (AttributeError, OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        name = self.model._meta.verbose_name_plural
+        self.stdout.write(
+            f'{name}: новых {len(inserts)}, изменённых {len(updates)}, '
+            f'без изменений {unchanged}, нет в файле {absent}.')
+        if options['dry_run'] or not (inserts or updates):
+            return
+        batch_size = options['batch_size']
+        if inserts:
+            self.stdout.write('Добавление:')
+            # ignore_conflicts делает повторный или параллельный запуск
+            # безопасным: строки, добавленные с тех пор, пропускаются.
+            self.apply(inserts, batch_size, lambda batch: (
+                self.model.objects.bulk_create(batch, ignore_conflicts=True)))
+        if updates:
+            self.stdout.write('Обновление:')
+            self.apply(updates, batch_size, lambda batch: (
+                self.model.objects.bulk_update(batch, self.value_fields)))
+        catalog_changed.send(sender=self.model)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с.'))
@@ -0,0 +1,61 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.transfer import (FORMATS, RecordWriter, detect_format,
+                              recipe_record)
+
+
+class Command(BaseCommand):
+    help = ('Выгружает рецепты в JSON Lines или CSV, читая базу пачками по '
+            'возрастанию id.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для выгрузки, «-» — stdout.')
+        parser.add_argument('--format', choices=FORMATS, dest='file_format',
+                            help='Формат файла (по умолчанию по расширению).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Рецептов, читаемых за один запрос.')
+        parser.add_argument('--after', type=int, default=0,
+                            help='Выгрузить рецепты с id больше указанного '
+                                 'и дописать их в конец файла (продолжение '
+                                 'прерванной выгрузки).')
+
+    def batches(self, batch_size, after):
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags', 'ingredients__ingredient').order_by('pk')
+        while True:
+            batch = list(queryset.filter(pk__gt=after)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            after = batch[-1].pk
+
+    def handle(self, *args, **options):
+        path = options['path']
+        # При выгрузке в stdout отчёт о ходе работы пишется в stderr.
+        report = self.stderr if path == '-' else self.stdout
+        append = options['after'] > 0
+        file = (sys.stdout if path == '-' else open(
+            path, 'a' if append else 'w', encoding='utf-8', newline=''))
+        file_format = detect_format(path, options['file_format'])
+        writer = RecordWriter(file, file_format, header=not append)
+        exported = 0
+        started = time.monotonic()
+        try:
+            for batch in self.batches(options['batch_size'], options['after']):
+                for recipe in batch:
+                    writer.write(recipe_record(recipe))
+                exported += len(batch)
+                elapsed = time.monotonic() - started
+                report.write(
+                    f'Выгружено {exported} рецептов (до id {batch[-1].pk}), '
+                    f'{exported / elapsed:.0f} в секунду.')
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        elapsed = time.monotonic() - started
+        report.write(self.style.SUCCESS(
+            f'Готово: {exported} рецептов за {elapsed:.1f} с.'))
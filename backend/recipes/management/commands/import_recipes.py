@@ -0,0 +1,198 @@
+import os
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.search import index_recipes
+from recipes.signals import catalog_changed, change_counter, recipes_imported
+from recipes.transfer import FORMATS, batched, detect_format, read_records
+from users.models import User
+
+MAX_SMALL_INTEGER = 32767
+
+
+def positive_integer(value, field):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field}: ожидается целое число')
+    if not 1 <= value <= MAX_SMALL_INTEGER:
+        raise ValueError(f'{field}: число вне диапазона 1..'
+                         f'{MAX_SMALL_INTEGER}')
+    return value
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты из файла JSON Lines или CSV пачками, каждая '
+            'в своей транзакции. После сбоя загрузку можно продолжить '
+            'с --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с рецептами.')
+        parser.add_argument('--format', choices=FORMATS, dest='file_format',
+                            help='Формат файла (по умолчанию по расширению).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Рецептов в одной транзакции.')
+        parser.add_argument('--keep-ids', action='store_true',
+                            help='Сохранить id рецептов из файла.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Пропустить пачки, загруженные ранее.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = detect_format(path, options['file_format'])
+        progress_path = f'{path}.progress'
+        skip = 0
+        if options['resume'] and os.path.exists(progress_path):
+            with open(progress_path) as progress:
+                skip = int(progress.read() or 0)
+            self.stdout.write(f'Продолжение после записи {skip}.')
+        self.keep_ids = options['keep_ids']
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.ingredients = {
+            (name, unit): pk for pk, name, unit in
+            Ingredient.objects.values_list('pk', 'name', 'measurement_unit')
+        }
+        self.created_ingredients = 0
+        imported = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as file:
+            records = read_records(file, file_format, skip)
+            try:
+                for batch in batched(records, options['batch_size']):
+                    self.import_batch(batch)
+                    imported += len(batch)
+                    with open(progress_path, 'w') as progress:
+                        progress.write(str(batch[-1][0]))
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f'Загружено {imported} рецептов, '
+                        f'{imported / elapsed:.0f} в секунду.')
+            except ValueError as error:
+                raise CommandError(error)
+            except IntegrityError as error:
+                raise CommandError(
+                    f'Пачка после записи {skip + imported} не загружена: '
+                    f'{error}')
+        if (self.keep_ids
+                or not connection.features.can_return_rows_from_bulk_insert):
+            self.reset_sequence()
+        if self.created_ingredients:
+            catalog_changed.send(sender=Ingredient)
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {imported} рецептов за {elapsed:.1f} с '
+            f'({imported / max(elapsed, 1e-9):.0f} в секунду), '
+            f'новых ингредиентов: {self.created_ingredients}.'))
+
+    def reset_sequence(self):
+        """Сдвигает последовательность id после вставки с явными id."""
+        statements = connection.ops.sequence_reset_sql(no_style(), [Recipe])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def resolve_ingredients(self, batch):
+        """Создаёт ингредиенты, которых ещё нет в справочнике."""
+        missing = {
+            (item['name'], item['measurement_unit'])
+            for _, record in batch for item in record.get('ingredients', ())
+            if isinstance(item, dict) and item.get('name')
+            and item.get('measurement_unit')
+        } - self.ingredients.keys()
+        if not missing:
+            return {}
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in missing
+        )
+        names = {name for name, _ in missing}
+        return {
+            (name, unit): pk for pk, name, unit in
+            Ingredient.objects.filter(name__in=names).values_list(
+                'pk', 'name', 'measurement_unit')
+            if (name, unit) in missing
+        }
+
+    def build_recipe(self, record, authors, ingredients):
+        author_id = authors.get(record.get('author'))
+        if author_id is None:
+            raise ValueError(f'неизвестный автор {record.get("author")!r}')
+        name = (record.get('name') or '').strip()
+        if not name or len(name) > 200:
+            raise ValueError('name: от 1 до 200 символов')
+        recipe = Recipe(
+            author_id=author_id,
+            name=name,
+            text=record.get('text') or '',
+            cooking_time=positive_integer(record.get('cooking_time'),
+                                          'cooking_time'),
+            image=record.get('image') or None,
+        )
+        if self.keep_ids:
+            recipe.pk = positive_integer(record.get('id'), 'id')
+        try:
+            tag_ids = [self.tags[slug] for slug in record.get('tags', ())]
+        except KeyError as error:
+            raise ValueError(f'неизвестный тег {error.args[0]!r}')
+        items = {}
+        for item in record.get('ingredients', ()):
+            key = (item.get('name'), item.get('measurement_unit'))
+            if not all(key):
+                raise ValueError('у ингредиента нет названия или единицы')
+            ingredient_id = ingredients.get(key) or self.ingredients[key]
+            if ingredient_id in items:
+                raise ValueError(f'ингредиент {key[0]!r} указан дважды')
+            items[ingredient_id] = positive_integer(item.get('amount'),
+                                                    'amount')
+        if not items:
+            raise ValueError('у рецепта нет ингредиентов')
+        return recipe, tag_ids, items
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        authors = dict(User.objects.filter(
+            email__in={record.get('author') for _, record in batch}
+        ).values_list('email', 'pk'))
+        ingredients = self.resolve_ingredients(batch)
+        built = []
+        for number, record in batch:
+            try:
+                built.append(self.build_recipe(record, authors, ingredients))
+            except (AttributeError, KeyError, TypeError, ValueError) as error:
+                raise CommandError(f'Запись {number}: {error}')
+        recipes = [recipe for recipe, _, _ in built]
+        if (not self.keep_ids
+                and not connection.features.can_return_rows_from_bulk_insert):
+            # Без RETURNING база не сообщает id вставленных строк, поэтому
+            # назначаем их сами внутри транзакции.
+            last_id = Recipe.objects.aggregate(last=Max('pk'))['last'] or 0
+            for offset, recipe in enumerate(recipes, 1):
+                recipe.pk = last_id + offset
+        Recipe.objects.bulk_create(recipes)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe_id=recipe.pk, ingredient_id=ingredient_id,
+                             amount=amount)
+            for recipe, _, items in built
+            for ingredient_id, amount in items.items()
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag_id)
+            for recipe, tag_ids, _ in built for tag_id in tag_ids
+        )
+        for author_id, count in Counter(
+                recipe.author_id for recipe in recipes).items():
+            change_counter(User, author_id, 'recipes_count', count)
+        recipe_ids = [recipe.pk for recipe in recipes]
+        index_recipes(recipe_ids)
+        self.ingredients.update(ingredients)
+        self.created_ingredients += len(ingredients)
+        transaction.on_commit(lambda: recipes_imported.send(
+            sender=Recipe, recipe_ids=recipe_ids))
@@ -1,17 +1,11 @@
-import csv
-from django.core.management.base import BaseCommand
+from recipes.loaders import CatalogLoadCommand
 from recipes.models import Tag
 
 
-class Command(BaseCommand):
-    def handle(self, **options):
-        with open("tags.csv", encoding='utf-8') as csv_file:
-            reader = csv.reader(csv_file, delimiter=",")
-            Tag.objects.bulk_create([
-                Tag(
-                    id=num,
-                    name=line[0],
-                    color=line[1],
-                    slug=line[2]
-                ) for num, line in enumerate(reader)
-            ])
+class Command(CatalogLoadCommand):
+    help = ('Загружает теги (название, цвет, слаг) из CSV или JSON: новые '
+            'добавляет, у существующих обновляет название и цвет.')
+    model = Tag
+    fields = ('name', 'color', 'slug')
+    key_fields = ('slug',)
+    default_path = 'tags.csv'
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from recipes.search import index_recipes
+
+
+class Command(BaseCommand):
+    help = ('Перестраивает поисковый индекс рецептов, например после '
+            'переименования ингредиентов или тегов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipe', type=int, nargs='*',
+                            dest='recipe_ids',
+                            help='id рецептов для переиндексации.')
+
+    def handle(self, *args, **options):
+        total = index_recipes(options['recipe_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {total}.'))
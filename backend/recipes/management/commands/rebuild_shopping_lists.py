@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает агрегированные списки покупок по корзинам '
+            'пользователей или проверяет их согласованность.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить, ничего не изменяя.')
+        parser.add_argument('--user', type=int, nargs='*', dest='user_ids',
+                            help='id пользователей для пересчёта.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or None
+        expected = ShoppingListItem.objects.expected_totals(user_ids)
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in items.values_list(
+                'user_id', 'ingredient_id', 'amount')
+        }
+        deltas = {
+            key: expected.get(key, 0) - actual.get(key, 0)
+            for key in expected.keys() | actual.keys()
+            if expected.get(key, 0) != actual.get(key, 0)
+        }
+        if options['check']:
+            if deltas:
+                raise CommandError(
+                    f'Расхождений в списках покупок: {len(deltas)}.')
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок согласованы ({len(expected)} позиций).'))
+            return
+        ShoppingListItem.objects.apply_deltas(deltas)
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено позиций: {len(deltas)}.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.feed import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = ('Заново заполняет ленты подписок, например после изменения '
+            'FEED_FANOUT_LIMIT или правок подписок в обход API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='*', dest='user_ids',
+                            help='id пользователей, чьи ленты перестроить.')
+
+    def handle(self, *args, **options):
+        total = rebuild_timelines(options['user_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {total}.'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Cart, Favorite, Recipe
+from users.models import Subscription, User
+
+
+def count_subquery(model, field):
+    """Подзапрос с количеством строк ``model``, ссылающихся на внешний
+    объект через ``field``."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()
+    ), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'carts_count', Cart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики избранного, корзин, '
+            'рецептов и подписчиков.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, counter, related_model, field in COUNTERS:
+                expected = count_subquery(related_model, field)
+                updated = model.objects.annotate(expected=expected).exclude(
+                    **{counter: expected}
+                ).update(**{counter: expected})
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}.{counter}: '
+                    f'исправлено {updated}'
+                )
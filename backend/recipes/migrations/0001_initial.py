@@ -0,0 +1,130 @@
+# Generated by Django 3.2.18 on 2026-10-18 04:10
+
+import django.core.validators
+from django.db import migrations, models
+import foodgram.db.models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': ('Корзина',),
+                'verbose_name_plural': 'Корзина',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Favorite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Избранный рецепт',
+                'verbose_name_plural': 'Избранные рецепты',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Название ингредиента', max_length=200, verbose_name='Название ингредиента')),
+                ('measurement_unit', models.CharField(help_text='Единица измерения', max_length=200, verbose_name='Единица измерения')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент',
+                'verbose_name_plural': 'Ингредиенты',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Recipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Название рецепта', max_length=200, verbose_name='Название рецепта')),
+                ('image', models.ImageField(default=None, null=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='media/')),
+                ('thumbnail', models.ImageField(blank=True, editable=False, null=True, upload_to='thumbnails/', verbose_name='Уменьшенное изображение')),
+                ('text', models.TextField()),
+                ('cooking_time', models.PositiveSmallIntegerField(verbose_name='Время приготовления')),
+                ('favorites_count', models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='В избранном')),
+                ('carts_count', models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='В списках покупок')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Рецепт',
+                'verbose_name_plural': 'Рецепты',
+                'ordering': ['-id'],
+            },
+            bases=(foodgram.db.models.CounterFieldsMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='RecipeIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Количество ингредиентов не может быть меньше 1')], verbose_name='Количество')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в рецепте',
+                'verbose_name_plural': 'Ингредиенты в рецепте',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, verbose_name='Основа слова')),
+                ('weight', models.PositiveSmallIntegerField(verbose_name='Вес')),
+            ],
+            options={
+                'verbose_name': 'Слово поискового индекса',
+                'verbose_name_plural': 'Поисковый индекс',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Список покупок',
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Название тега', max_length=200, unique=True, verbose_name='Название тега')),
+                ('color', models.CharField(choices=[('#4682B4', 'Синий'), ('#FF4500', 'Оранжевый'), ('#006400', 'Зеленый'), ('#9370DB', 'Фиолетовый'), ('#FFD700', 'Желтый')], max_length=7, null=True, validators=[django.core.validators.RegexValidator('^#([A-Fa-f0-9]{6}|[A-Fa-f0-9]{3})$', message='Укажите HEX-код выбранного цвета')], verbose_name='Цвет тега')),
+                ('slug', models.SlugField(max_length=200, unique=True, validators=[django.core.validators.RegexValidator('^[-a-zA-Z0-9_]+$', message='Можно использовать только буквы английского алфавита, цифры и знак подчёркивания')], verbose_name='slug тега')),
+            ],
+            options={
+                'verbose_name': ('Тег',),
+                'verbose_name_plural': 'Теги',
+                'ordering': ('name',),
+            },
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Ленты подписок',
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+"""Индексы поиска на PostgreSQL, которые нельзя описать полями моделей.
+
+* GIN-индекс pg_trgm на ``UPPER(name)`` ингредиентов для автодополнения
+  (``api.autocomplete``): именно это выражение Django использует для
+  ``icontains`` и ``istartswith`` на PostgreSQL.
+* Столбец tsvector ``search_vector`` рецептов с GIN-индексом для
+  полнотекстового поиска (``recipes.search``).
+
+Столбец не описан полем модели: в Django 3.2 тип tsvector есть только в
+``django.contrib.postgres``, а модели должны работать и без драйвера
+PostgreSQL. На остальных базах операции ничего не делают.
+"""
+from django.db import migrations
+
+
+class PostgreSQLRunSQL(migrations.RunSQL):
+    """``RunSQL``, выполняемый только на PostgreSQL"""
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state,
+                                      to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state,
+                                       to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        # IF NOT EXISTS: на базах, где индексы уже создал прежний обработчик
+        # post_migrate, миграция только отмечается применённой.
+        PostgreSQLRunSQL(
+            sql=[
+                'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+                'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+                'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops)',
+            ],
+            reverse_sql=[
+                'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+            ],
+        ),
+        PostgreSQLRunSQL(
+            sql=[
+                'ALTER TABLE recipes_recipe '
+                'ADD COLUMN IF NOT EXISTS search_vector tsvector',
+                'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+                'ON recipes_recipe USING gin (search_vector)',
+            ],
+            reverse_sql=[
+                'DROP INDEX IF EXISTS recipes_recipe_search_vector',
+                'ALTER TABLE recipes_recipe '
+                'DROP COLUMN IF EXISTS search_vector',
+            ],
+        ),
+    ]
@@ -1,8 +1,11 @@
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import IntegrityError, models, transaction
+from django.db.models import Exists, OuterRef, Prefetch, Sum, UniqueConstraint
+from django.utils import timezone
 
-from users.models import User
+from foodgram.db.models import CounterFieldsMixin
+from users.models import Subscription, User
+from .storage import ContentAddressedStorage
 
 
 class Tag(models.Model):
@@ -86,7 +89,66 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов с подготовкой данных для сериализации"""
+
+    @staticmethod
+    def related_lookups():
+        """Теги и ингредиенты рецепта для ``prefetch_related``."""
+        return (
+            'tags',
+            Prefetch(
+                'ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    def with_related(self):
+        """Подгружает автора, теги и ингредиенты фиксированным числом
+        запросов, независимо от количества рецептов."""
+        return self.select_related('author').prefetch_related(
+            *self.related_lookups())
+
+    def touch(self):
+        """Отмечает рецепты изменёнными, не вызывая ``save``."""
+        return self.update(updated=timezone.now())
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги избранного, корзины и подписки на автора
+        для пользователя, от лица которого выполняется запрос."""
+        if user is None or user.is_anonymous:
+            return self
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(Cart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_author_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+    def limit_per_author(self, limit):
+        """Оставляет не более ``limit`` последних рецептов каждого автора.
+
+        Рецепт остаётся, если у автора нет ``limit`` более новых рецептов.
+        Коррелированный подзапрос проверяет только существование
+        ``limit``-го из них (OFFSET ``limit - 1`` LIMIT 1 по индексу
+        (author, id)) и читает не больше ``limit`` строк, сколько бы
+        рецептов ни было у автора. Django 3.2 не умеет фильтровать по
+        оконным функциям, а подзапрос позволяет загрузить рецепты всех
+        авторов страницы одним запросом.
+        """
+        if limit is None:
+            return self
+        if limit <= 0:
+            return self.none()
+        newer = Recipe.objects.filter(
+            author=OuterRef('author'), pk__gt=OuterRef('pk')
+        ).order_by().values('pk')[limit - 1:limit]
+        return self.filter(~Exists(newer))
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель рецептов"""
     author = models.ForeignKey(
         User,
@@ -102,9 +164,17 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='media/',
+        storage=ContentAddressedStorage(),
         null=True,
         default=None,
     )
+    thumbnail = models.ImageField(
+        verbose_name='Уменьшенное изображение',
+        upload_to='thumbnails/',
+        null=True,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField()
     tags = models.ManyToManyField(
         Tag,
@@ -116,11 +186,37 @@ class Recipe(models.Model):
     )
     amount_ingredients = models.ManyToManyField(Ingredient,
                                                 through='RecipeIngredient')
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        db_index=True,
+        editable=False,
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        db_index=True,
+        editable=False,
+    )
+    # Версия представления рецепта для кеша фрагментов (api.fragments).
+    # Меняется при каждом сохранении; изменения в обход save() должны
+    # вызывать RecipeQuerySet.touch().
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+
+    counter_fields = ('favorites_count', 'carts_count')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['author', 'id'], name='recipe_author_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -223,3 +319,218 @@ class Cart(models.Model):
 
     def __str__(self) -> str:
         return f'{self.user.username} - {self.recipe.name}'
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    """Инкрементальное обновление агрегированного списка покупок"""
+
+    def apply_deltas(self, deltas):
+        """Прибавляет к суммам изменения вида
+        ``{(user_id, ingredient_id): delta}``, удаляя обнулившиеся строки."""
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        try:
+            with transaction.atomic():
+                self._apply_deltas(deltas)
+        except IntegrityError:
+            # Строку для той же пары параллельно создала другая транзакция;
+            # после её фиксации строка видна и блокируется при повторе.
+            with transaction.atomic():
+                self._apply_deltas(deltas)
+
+    def _apply_deltas(self, deltas):
+        existing = {
+            (item.user_id, item.ingredient_id): item
+            for item in self.model.objects.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in deltas},
+                ingredient_id__in={
+                    ingredient_id for _, ingredient_id in deltas},
+            )
+        }
+        created, changed, emptied = [], [], []
+        for (user_id, ingredient_id), delta in deltas.items():
+            item = existing.get((user_id, ingredient_id))
+            if item is None:
+                if delta > 0:
+                    created.append(self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=delta
+                    ))
+                continue
+            item.amount += delta
+            if item.amount > 0:
+                changed.append(item)
+            else:
+                emptied.append(item.pk)
+        self.model.objects.bulk_create(created)
+        self.model.objects.bulk_update(changed, ['amount'])
+        self.model.objects.filter(pk__in=emptied).delete()
+
+    @staticmethod
+    def recipe_amounts(recipe_id):
+        return dict(RecipeIngredient.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        """Учитывает рецепт, добавленный пользователем в корзину."""
+        self.apply_deltas({
+            (user_id, ingredient_id): sign * amount
+            for ingredient_id, amount in self.recipe_amounts(
+                recipe_id).items()
+        })
+
+    def remove_recipe(self, user_id, recipe_id):
+        """Учитывает рецепт, удалённый пользователем из корзины."""
+        self.add_recipe(user_id, recipe_id, sign=-1)
+
+    def change_recipe(self, recipe_id, old_amounts, new_amounts):
+        """Переносит изменение состава рецепта в списки покупок всех
+        пользователей, у которых рецепт лежит в корзине."""
+        ingredient_deltas = {
+            ingredient_id: (new_amounts.get(ingredient_id, 0)
+                            - old_amounts.get(ingredient_id, 0))
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        if not any(ingredient_deltas.values()):
+            return
+        self.apply_deltas({
+            (user_id, ingredient_id): delta
+            for user_id in Cart.objects.filter(
+                recipe_id=recipe_id).values_list('user_id', flat=True)
+            for ingredient_id, delta in ingredient_deltas.items()
+        })
+
+    @staticmethod
+    def expected_totals(user_ids=None):
+        """Суммы, посчитанные заново по корзинам, в виде
+        ``{(user_id, ingredient_id): amount}``."""
+        # Условия по корзине задаются одним вызовом filter, чтобы Django
+        # не присоединил таблицу корзины дважды.
+        cart_filter = {'recipe__cart__isnull': False}
+        if user_ids is not None:
+            cart_filter['recipe__cart__user__in'] = user_ids
+        totals = RecipeIngredient.objects.filter(**cart_filter).values(
+            'recipe__cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).values_list(
+            'recipe__cart__user', 'ingredient', 'total'
+        ).order_by()
+        return {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in totals
+        }
+
+
+class ShoppingListItem(models.Model):
+    """Агрегированный список покупок пользователя.
+
+    Хранит суммарное количество каждого ингредиента по всем рецептам
+    в корзине. Обновляется сигналами сохранения и удаления корзины и
+    состава рецептов (``recipes.signals``), а массовые изменения в обход
+    сигналов (``bulk_create``, ``bulk_update``, ``update``) и изменения
+    внутри ``recipes.signals.recipe_rewrite`` должны вызывать
+    ``change_recipe`` сами.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='shopping_list_items',
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'ingredient'], name='unique_shopping_list'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user.username} - {self.ingredient.name}'
+
+
+class RecipeSearchToken(models.Model):
+    """Обратный индекс для поиска рецептов на базах без tsvector.
+
+    Хранит основы слов рецепта с весом части, в которой слово встретилось
+    (см. ``recipes.search``).
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='search_tokens',
+    )
+    token = models.CharField(max_length=64, verbose_name='Основа слова')
+    weight = models.PositiveSmallIntegerField(verbose_name='Вес')
+
+    class Meta:
+        verbose_name = 'Слово поискового индекса'
+        verbose_name_plural = 'Поисковый индекс'
+        constraints = [
+            UniqueConstraint(
+                fields=['recipe', 'token'], name='unique_search_token'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['token', 'recipe'],
+                         name='search_token_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id}: {self.token}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика.
+
+    Строки добавляются при публикации рецепта всем подписчикам автора
+    (см. ``recipes.feed``); рецепты авторов с очень большим числом
+    подписчиков в таблицу не попадают и читаются при запросе ленты.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+        related_name='timeline',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='+',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор рецепта',
+        related_name='+',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.recipe_id}'
@@ -0,0 +1,195 @@
+"""Полнотекстовый поиск рецептов по названию, описанию, тегам и ингредиентам.
+
+На PostgreSQL у таблицы рецептов есть столбец ``search_vector`` (tsvector
+в русской конфигурации) с GIN-индексом. Его создаёт миграция
+``recipes.0003_postgresql_search_indexes``, а не поле модели: в Django 3.2 тип
+tsvector есть только в ``django.contrib.postgres``, а модели должны
+работать и без драйвера PostgreSQL. На остальных базах используется
+обратный индекс в таблице ``RecipeSearchToken``.
+
+Оба индекса обновляет ``index_recipes``; ``schedule_indexing``
+откладывает обновление до фиксации транзакции и выполняет его один раз,
+сколько бы раз рецепт ни менялся внутри неё.
+"""
+import re
+
+from django.db import connections, transaction
+from django.db.models import (BooleanField, FloatField, OuterRef, Q, Subquery,
+                              Sum)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from foodgram.db.transaction import OnCommitBatch
+from .models import Recipe, RecipeIngredient, RecipeSearchToken
+
+SEARCH_CONFIG = 'russian'
+VECTOR_COLUMN = 'search_vector'
+# Вес части рецепта в обратном индексе, как A/B/C в tsvector.
+NAME_WEIGHT = 4
+TAGS_WEIGHT = INGREDIENTS_WEIGHT = 2
+TEXT_WEIGHT = 1
+MAX_TERMS = 8
+MIN_STEM = 3
+WORD_RE = re.compile(r'\w+')
+# Окончания, отбрасываемые при построении основы слова, длинные первыми.
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ов', 'ев',
+    'ах', 'ях', 'ом', 'ем', 'ам', 'ям', 'ию', 'ия',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def words(text):
+    return WORD_RE.findall(text.lower())[:MAX_TERMS]
+
+
+def terms(text):
+    """Уникальные основы слов поискового запроса."""
+    return list(dict.fromkeys(stem(word) for word in words(text)))
+
+
+def prefix_range(term):
+    """Условие «слово начинается с term» в виде диапазона, по которому
+    работает обычный индекс (LIKE с ESCAPE индекс SQLite не использует)."""
+    return Q(token__gte=term,
+             token__lt=term[:-1] + chr(ord(term[-1]) + 1))
+
+
+def is_postgresql(using):
+    return connections[using].vendor == 'postgresql'
+
+
+def update_search_vectors(recipe_ids=None, using='default'):
+    """Пересчитывает tsvector рецептов одним UPDATE на PostgreSQL."""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    recipe = quote(Recipe._meta.db_table)
+    through = Recipe.tags.through
+    tag_field = through._meta.get_field('tag')
+    ingredient_field = RecipeIngredient._meta.get_field('ingredient')
+    where, params = '', [SEARCH_CONFIG] * 3
+    if recipe_ids is not None:
+        where = f'WHERE {recipe}.id = ANY(%s)'
+        params.append(list(recipe_ids))
+    sql = f'''
+        UPDATE {recipe} SET {VECTOR_COLUMN} =
+            setweight(to_tsvector(%s, {recipe}.name), 'A')
+            || setweight(to_tsvector(%s, coalesce((
+                SELECT string_agg(ingredient.name, ' ')
+                FROM {quote(RecipeIngredient._meta.db_table)} item
+                JOIN {quote(ingredient_field.related_model._meta.db_table)}
+                    ingredient ON ingredient.id = item.ingredient_id
+                WHERE item.recipe_id = {recipe}.id
+            ), '') || ' ' || coalesce((
+                SELECT string_agg(tag.name, ' ')
+                FROM {quote(through._meta.db_table)} recipe_tag
+                JOIN {quote(tag_field.related_model._meta.db_table)}
+                    tag ON tag.id = recipe_tag.tag_id
+                WHERE recipe_tag.recipe_id = {recipe}.id
+            ), '')), 'B')
+            || setweight(to_tsvector(%s, {recipe}.text), 'C')
+        {where}
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def recipe_tokens(recipe):
+    """Основы слов рецепта с наибольшим весом части, где они встретились."""
+    parts = (
+        (recipe.name, NAME_WEIGHT),
+        (' '.join(item.ingredient.name for item in recipe.ingredients.all()),
+         INGREDIENTS_WEIGHT),
+        (' '.join(tag.name for tag in recipe.tags.all()), TAGS_WEIGHT),
+        (recipe.text, TEXT_WEIGHT),
+    )
+    tokens = {}
+    for text, weight in parts:
+        for word in WORD_RE.findall(text.lower()):
+            token = stem(word)[:64]
+            tokens[token] = max(tokens.get(token, 0), weight)
+    return tokens
+
+
+def update_search_tokens(recipe_ids=None, using='default', batch_size=500):
+    """Перестраивает обратный индекс рецептов пачками по ``batch_size``."""
+    recipes = Recipe.objects.using(using).order_by('pk')
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=list(recipe_ids))
+    ids = list(recipes.values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        with transaction.atomic(using=using):
+            RecipeSearchToken.objects.using(using).filter(
+                recipe_id__in=batch).delete()
+            RecipeSearchToken.objects.using(using).bulk_create(
+                RecipeSearchToken(recipe_id=recipe.pk, token=token,
+                                  weight=weight)
+                for recipe in Recipe.objects.using(using).filter(
+                    pk__in=batch
+                ).prefetch_related('tags', 'ingredients__ingredient')
+                for token, weight in recipe_tokens(recipe).items()
+            )
+    return len(ids)
+
+
+def index_recipes(recipe_ids=None, using='default'):
+    """Обновляет поисковый индекс рецептов (всех, если ``recipe_ids`` не
+    задан) и возвращает количество обработанных рецептов."""
+    if is_postgresql(using):
+        return update_search_vectors(recipe_ids, using)
+    return update_search_tokens(recipe_ids, using)
+
+
+class PendingIndexing(OnCommitBatch):
+    """Рецепты, которые нужно переиндексировать после фиксации транзакции"""
+
+    def process(self, recipe_ids):
+        index_recipes(recipe_ids, self.using)
+
+
+def schedule_indexing(recipe_id, using='default'):
+    PendingIndexing.add([recipe_id], using)
+
+
+def search_recipes(queryset, query):
+    """Оставляет рецепты, содержащие все слова запроса (слово запроса может
+    быть началом слова рецепта), и упорядочивает их по релевантности."""
+    query_terms = terms(query)
+    if not query_terms:
+        return queryset.none()
+    if is_postgresql(queryset.db):
+        table = connections[queryset.db].ops.quote_name(
+            Recipe._meta.db_table)
+        tsquery = ' & '.join(f'{word}:*' for word in words(query))
+        params = (SEARCH_CONFIG, tsquery)
+        rank = RawSQL(
+            f'ts_rank({table}.{VECTOR_COLUMN}, to_tsquery(%s, %s))',
+            params, output_field=FloatField())
+        match = RawSQL(
+            f'{table}.{VECTOR_COLUMN} @@ to_tsquery(%s, %s)',
+            params, output_field=BooleanField())
+        queryset = queryset.filter(match)
+    else:
+        tokens = RecipeSearchToken.objects.order_by()
+        any_term = Q()
+        for term in query_terms:
+            queryset = queryset.filter(
+                pk__in=tokens.filter(prefix_range(term)).values('recipe'))
+            any_term |= prefix_range(term)
+        rank = Coalesce(Subquery(
+            tokens.filter(any_term, recipe=OuterRef('pk')).values(
+                'recipe').annotate(rank=Sum('weight')).values('rank'),
+            output_field=FloatField(),
+        ), 0.0)
+    return queryset.annotate(search_rank=rank).order_by('-search_rank', '-id')
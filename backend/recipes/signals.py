@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import Signal, receiver
+
+from users.models import Subscription, User
+from .feed import backfill, fan_out
+from .models import (Cart, Favorite, Recipe, RecipeIngredient,
+                     ShoppingListItem, TimelineEntry)
+from .search import schedule_indexing
+
+# Отправляется при массовом изменении справочника (sender — модель), когда
+# post_save не вызывается, например после bulk_create в командах загрузки.
+catalog_changed = Signal()
+# Отправляется после массовой загрузки рецептов (recipe_ids — id новых
+# рецептов), так как bulk_create не вызывает post_save.
+recipes_imported = Signal()
+# id рецептов, которые вызывающий код меняет целиком (см. recipe_rewrite).
+rewritten_recipes = ContextVar('rewritten_recipes', default=frozenset())
+
+
+@contextmanager
+def recipe_rewrite(recipe_id):
+    """Отключает построчные обработчики состава, корзин и избранного
+    рецепта: список покупок одним изменением на весь рецепт обновляет
+    вызывающий код (сохранение рецепта в API, удаление рецепта), а
+    кеши и журнал подбора — сигналы самого рецепта."""
+    token = rewritten_recipes.set(rewritten_recipes.get() | {recipe_id})
+    try:
+        yield
+    finally:
+        rewritten_recipes.reset(token)
+
+
+def is_rewritten(recipe_id):
+    return recipe_id in rewritten_recipes.get()
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счётчик через F-выражение, не опуская его ниже 0."""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_created(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(instance, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Cart)
+def cart_created(instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'carts_count', 1)
+
+
+@receiver(post_delete, sender=Cart)
+def cart_deleted(instance, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    change_counter(Recipe, instance.recipe_id, 'carts_count', -1)
+
+
+def stored_values(instance, using, fields):
+    """Значения полей сохраняемой строки, записанные в базе, или None для
+    новой строки."""
+    if instance._state.adding or instance.pk is None:
+        return None
+    return type(instance).objects.using(using).filter(
+        pk=instance.pk).values_list(*fields).first()
+
+
+@receiver(pre_save, sender=Cart)
+def cart_saving(instance, using, **kwargs):
+    instance.stored = stored_values(instance, using, ('user_id', 'recipe_id'))
+
+
+@receiver(post_save, sender=Cart)
+def cart_saved_shopping_list(instance, **kwargs):
+    stored, current = instance.stored, (instance.user_id, instance.recipe_id)
+    if stored == current:
+        return
+    if stored is not None:
+        ShoppingListItem.objects.remove_recipe(*stored)
+    ShoppingListItem.objects.add_recipe(*current)
+
+
+@receiver(post_delete, sender=Cart)
+def cart_deleted_shopping_list(instance, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    # При каскадном удалении рецепта его состав может быть удалён раньше
+    # корзин; тогда списки покупок уже изменил сигнал удаления состава.
+    ShoppingListItem.objects.remove_recipe(instance.user_id,
+                                           instance.recipe_id)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def recipe_ingredient_saving(instance, using, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    instance.stored = stored_values(
+        instance, using, ('recipe_id', 'ingredient_id', 'amount'))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved_shopping_list(instance, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    old_amounts = {}
+    if instance.stored is not None:
+        recipe_id, ingredient_id, amount = instance.stored
+        if recipe_id == instance.recipe_id:
+            old_amounts = {ingredient_id: amount}
+        else:
+            ShoppingListItem.objects.change_recipe(
+                recipe_id, {ingredient_id: amount}, {})
+    ShoppingListItem.objects.change_recipe(
+        instance.recipe_id, old_amounts,
+        {instance.ingredient_id: instance.amount})
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted_shopping_list(instance, **kwargs):
+    if is_rewritten(instance.recipe_id):
+        return
+    ShoppingListItem.objects.change_recipe(
+        instance.recipe_id, {instance.ingredient_id: instance.amount}, {})
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, using, **kwargs):
+    schedule_indexing(instance.pk, using)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(instance, using, **kwargs):
+    schedule_indexing(instance.recipe_id, using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, using, **kwargs):
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        schedule_indexing(instance.pk, using)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, using, **kwargs):
+    if created:
+        fan_out([instance.pk], using)
+
+
+@receiver(recipes_imported, sender=Recipe)
+def recipes_imported_fan_out(recipe_ids, **kwargs):
+    fan_out(recipe_ids)
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created_backfill(instance, created, using, **kwargs):
+    if created:
+        backfill(instance.user_id, instance.author_id, using)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted_timeline(instance, using, **kwargs):
+    TimelineEntry.objects.using(using).filter(
+        user_id=instance.user_id, author_id=instance.author_id).delete()
@@ -0,0 +1,24 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором файл называется по SHA-256 своего содержимого.
+
+    Одинаковые изображения, загруженные разными пользователями или
+    повторно, занимают на диске одно место, а уже существующий файл с тем
+    же именем гарантированно содержит те же байты.
+    """
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest.hexdigest() + extension)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
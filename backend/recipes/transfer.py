@@ -0,0 +1,98 @@
+"""Формат файлов для команд ``import_recipes`` и ``export_recipes``.
+
+Каждый рецепт — одна строка JSON Lines или CSV с колонками ``FIELDS``.
+Автор задаётся email, теги — слагами, ингредиенты — названием, единицей
+измерения и количеством; в CSV списки тегов и ингредиентов записываются
+JSON-строкой. Изображение передаётся именем файла в хранилище.
+"""
+import csv
+import json
+from itertools import islice
+
+FIELDS = ('id', 'author', 'name', 'text', 'cooking_time', 'image', 'tags',
+          'ingredients')
+LIST_FIELDS = ('tags', 'ingredients')
+FORMATS = ('jsonl', 'csv')
+
+
+def detect_format(path, file_format=None):
+    if file_format:
+        return file_format
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def load_json(number, text, expected):
+    try:
+        value = json.loads(text)
+    except ValueError as error:
+        raise ValueError(f'Запись {number}: некорректный JSON ({error})')
+    if not isinstance(value, expected):
+        raise ValueError(f'Запись {number}: неверная структура данных')
+    return value
+
+
+def read_records(file, file_format, skip=0):
+    """Возвращает пары ``(номер записи, словарь)``, пропуская первые
+    ``skip`` записей без разбора JSON."""
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(file), 1):
+            if number <= skip:
+                continue
+            for field in LIST_FIELDS:
+                row[field] = load_json(number, row.get(field) or '[]', list)
+            yield number, row
+        return
+    for number, line in enumerate(file, 1):
+        if number > skip and line.strip():
+            yield number, load_json(number, line, dict)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class RecordWriter:
+    """Построчная запись рецептов в JSON Lines или CSV"""
+
+    def __init__(self, file, file_format, header=True):
+        self.file = file
+        self.csv = None
+        if file_format == 'csv':
+            self.csv = csv.DictWriter(file, FIELDS)
+            if header:
+                self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv is None:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            return
+        self.csv.writerow({
+            field: (json.dumps(value, ensure_ascii=False)
+                    if field in LIST_FIELDS else value)
+            for field, value in record.items()
+        })
+
+
+def recipe_record(recipe):
+    """Рецепт с автором, тегами и ингредиентами в виде записи файла."""
+    return {
+        'id': recipe.pk,
+        'author': recipe.author.email,
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'image': recipe.image.name or '',
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            } for item in recipe.ingredients.all()
+        ],
+    }
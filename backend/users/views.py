@@ -1,29 +1,34 @@
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
-from rest_framework import status
+from rest_framework import filters, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from api.mixins import SubscriptionsMixin, ViewerRelationsMixin
 from api.pagination import LimitPageNumberPaginator
 from api.serializers import (SubscribeSerializer, SubscribeWriteSerializer,
                              UserSerializer)
 from .models import Subscription, User
 
 
-class UserViewSet(UserViewSet):
+class UserViewSet(ViewerRelationsMixin, SubscriptionsMixin, UserViewSet):
     """Вьюсет для модели User"""
     pagination_class = LimitPageNumberPaginator
     serializer_class = UserSerializer
+    filter_backends = (filters.OrderingFilter,)
+    ordering_fields = ('id', 'followers_count', 'recipes_count')
+    ordering = ('id',)
 
     @action(detail=False, methods=['get'],
             permission_classes=(IsAuthenticated,),
             pagination_class=LimitPageNumberPaginator)
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscription__user=request.user)
-        page = self.paginate_queryset(queryset)
-        serializer = SubscribeSerializer(page, many=True,
-                                         context={'request': request})
+        recipes_limit = self.get_recipes_limit()
+        page = self.paginate_queryset(self.get_subscriptions(recipes_limit))
+        context = self.get_serializer_context()
+        context['recipes_limit'] = recipes_limit
+        serializer = SubscribeSerializer(page, many=True, context=context)
         return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post', 'delete'],
@@ -33,7 +38,8 @@ class UserViewSet(UserViewSet):
 
         if request.method == 'POST':
             serializer = SubscribeWriteSerializer(
-                author, data=request.data, context={"request": request})
+                author, data=request.data,
+                context=self.get_serializer_context())
             serializer.is_valid(raise_exception=True)
             Subscription.objects.get_or_create(user=request.user,
                                                author=author)